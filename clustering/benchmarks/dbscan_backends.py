@@ -0,0 +1,82 @@
+## DBSCAN backend benchmark
+##
+## Times each clusterBucket backend on synthetic time buckets shaped like early
+## round data (most points stacked on the two spawns) and reports the peak RSS
+## each one needs. Every run happens in a fresh process so peaks don't carry
+## over, and the RSS after imports is subtracted so only the clustering shows.
+##
+## Usage: python benchmarks/dbscan_backends.py --points 20000 100000 --backends default graph grid
+## Linux/macOS only (uses the resource module).
+
+import argparse, json, os, sys, time
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csgo_clusters.metrics import peakRss
+
+
+def spawnBucket(pointCount, seed=0, spread=60):
+    #points of one early time bucket: two spawn stacks spread spread map units plus players already moving out
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    stacked = int(pointCount * 0.8)
+    spawns = np.array([[-500.0, -800.0], [300.0, 2200.0]])
+    points = spawns[rng.integers(0, 2, stacked)] + rng.normal(0, spread, (stacked, 2))
+    moving = rng.uniform([-2500, -1200], [2000, 3200], (pointCount - stacked, 2))
+    return np.concatenate([points, moving])
+
+
+def runBackend(pointCount, backend, options, queue):
+    from csgo_clusters.clusters import clusterBucket
+    import numpy as np
+
+    points = spawnBucket(pointCount)
+    baseline = peakRss()
+    start = time.perf_counter()
+    labels, core = clusterBucket(points, backend=backend, **options)
+    seconds = time.perf_counter() - start
+    queue.put({'points': pointCount, 'backend': backend, 'seconds': seconds,
+               'peakRssBytes': peakRss() - baseline, 'clusters': int(len(np.unique(labels[labels >= 0]))),
+               'noise': float(np.mean(labels == -1))})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and peak memory of clusterBucket backends per time bucket")
+    parser.add_argument('--points', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--backends', nargs='+', default=['default', 'graph', 'grid'])
+    parser.add_argument('--eps', type=float, default=80)
+    parser.add_argument('--min-samples', type=int, default=30)
+    parser.add_argument('--grid-size', type=float, default=20.0)
+    parser.add_argument('--chunk-entries', type=int, default=1000000)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    options = {'eps': args.eps, 'minSamples': args.min_samples, 'gridSize': args.grid_size, 'chunkEntries': args.chunk_entries}
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    print("%10s %10s %10s %12s %9s %7s" % ('points', 'backend', 'seconds', 'peak MB', 'clusters', 'noise'))
+    for pointCount in args.points:
+        for backend in args.backends:
+            queue = context.Queue()
+            process = context.Process(target=runBackend, args=(pointCount, backend, options, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                #most likely killed for running out of memory
+                result = {'points': pointCount, 'backend': backend, 'failed': process.exitcode}
+                print("%10d %10s     failed (exit code %s)" % (pointCount, backend, process.exitcode))
+            else:
+                result = queue.get()
+                print("%10d %10s %10.3f %12.1f %9d %7.3f" % (pointCount, backend, result['seconds'], result['peakRssBytes'] / 2 ** 20,
+                                                             result['clusters'], result['noise']))
+            results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=1)
+
+
+if __name__ == '__main__':
+    main()
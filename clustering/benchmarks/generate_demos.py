@@ -0,0 +1,155 @@
+## Synthetic demo generator
+##
+## Writes .dat files in the tab-separated format importToFile.js emits, one row
+## per game event: tick, event name, event JSON, locations JSON and entities
+## JSON (the last two 'null' for events without players). Matches are made of
+## rounds where players spawn on their team's side, walk towards one of a few
+## sites leaving footsteps, fire, get hurt and die, until one side is dead or
+## the round timer runs out. Coordinates are multiples of 1/32 like the cell
+## coordinates of a real demo, so the parser sees the same mix of floats and ints.
+## Every file starts with the demo_header row importToFile.js writes, giving its
+## tick rate.
+##
+## Usage: python benchmarks/generate_demos.py OUTPUT_DIR --matches 20 --players 10 --round-seconds 30 90 --tick-rate 64
+
+import argparse, json, os, random
+
+tickRate = 128
+freezeTime = 15
+
+#team number -> spawn area, and the spots players head for
+spawns = {2: (-600.0, -800.0), 3: (300.0, 2200.0)}
+sites = [(-1500.0, 2600.0), (1100.0, 2500.0), (-300.0, 1000.0), (-1900.0, 1200.0), (700.0, 400.0)]
+
+walkSpeed = 250.0 #units per second
+footstepInterval = 0.35 #seconds between footsteps of a moving player
+
+
+def snap(value):
+    #positions come from 5 bit cells plus a float offset, so they land on 1/32
+    return round(value * 32) / 32
+
+
+def location(position):
+    x, y, z = (snap(value) for value in position)
+    return {'x': int(x) if x == int(x) else x, 'y': int(y) if y == int(y) else y, 'z': int(z) if z == int(z) else z}
+
+
+def writeRow(lines, tick, name, event, locations=None, entities=None):
+    lines.append('\t'.join([str(tick), name, json.dumps(event, separators=(',', ':')),
+                            json.dumps(locations, separators=(',', ':')) if locations is not None else 'null',
+                            json.dumps(entities, separators=(',', ':')) if entities is not None else 'null']))
+
+
+def matchLines(rng, rounds, players, roundSeconds, tickRate=tickRate):
+    #every row of one match
+    lines = []
+    writeRow(lines, 0, 'demo_header', {'tickRate': tickRate})
+    tick = rng.randint(100, 2000)
+    teams = {player: 2 if player <= players // 2 else 3 for player in range(1, players + 1)}
+    userIds = {player: player + 1 for player in teams}
+
+    writeRow(lines, tick, 'begin_new_match', {})
+    for roundNumber in range(rounds):
+        tick += rng.randint(5, 20) * tickRate
+        writeRow(lines, tick, 'round_prestart', {})
+
+        positions = {}
+        for player, team in teams.items():
+            spawnX, spawnY = spawns[team]
+            positions[player] = [spawnX + rng.gauss(0, 150), spawnY + rng.gauss(0, 150), rng.uniform(-10, 10)]
+            tick += 1
+            writeRow(lines, tick, 'player_spawn', {'userid': userIds[player], 'teamnum': team},
+                     {'player': location(positions[player])}, {'player': player})
+
+        tick += rng.randint(1, 10)
+        writeRow(lines, tick, 'round_start', {'timelimit': 115, 'fraglimit': 0, 'objective': 'BOMB TARGET'})
+        tick += freezeTime * tickRate
+        writeRow(lines, tick, 'round_freeze_end', {})
+
+        targets = {player: rng.choice(sites) for player in teams}
+        alive = set(teams)
+        nextStep = {player: tick + rng.randint(0, int(footstepInterval * tickRate)) for player in teams}
+        end = tick + int(rng.uniform(*roundSeconds) * tickRate)
+        winner = None
+
+        while tick < end and winner is None:
+            tick += rng.randint(1, 8)
+
+            for player in sorted(alive):
+                if tick < nextStep[player]:
+                    continue
+                #walk towards the target with some wander, the step covers the time since the last one
+                x, y, z = positions[player]
+                targetX, targetY = targets[player]
+                distance = max(1.0, ((targetX - x) ** 2 + (targetY - y) ** 2) ** 0.5)
+                step = min(distance, walkSpeed * footstepInterval)
+                positions[player] = [x + (targetX - x) / distance * step + rng.gauss(0, 20),
+                                     y + (targetY - y) / distance * step + rng.gauss(0, 20), z]
+                nextStep[player] = tick + int(footstepInterval * tickRate * rng.uniform(0.8, 1.2))
+                writeRow(lines, tick, 'player_footstep', {'userid': userIds[player]},
+                         {'player': location(positions[player])}, {'player': player})
+
+            roll = rng.random()
+            player = rng.choice(sorted(alive))
+            if roll < 0.05:
+                writeRow(lines, tick, 'weapon_fire', {'userid': userIds[player], 'weapon': 'weapon_ak47', 'silenced': False},
+                         {'player': location(positions[player])}, {'player': player})
+            elif roll < 0.06:
+                writeRow(lines, tick, 'player_jump', {'userid': userIds[player]}, {'player': location(positions[player])}, {'player': player})
+            elif roll < 0.062:
+                #footsteps of a player the importer couldn't find an entity for
+                writeRow(lines, tick, 'player_footstep', {'userid': 0})
+            elif roll < 0.0635:
+                enemies = [other for other in alive if teams[other] != teams[player]]
+                if enemies:
+                    attacker = rng.choice(enemies)
+                    writeRow(lines, tick, 'player_hurt', {'userid': userIds[player], 'attacker': userIds[attacker], 'health': 0, 'dmg_health': 100},
+                             {'player': location(positions[player]), 'attacker': location(positions[attacker])}, {'player': player, 'attacker': attacker})
+                    writeRow(lines, tick, 'player_death', {'userid': userIds[player], 'attacker': userIds[attacker], 'weapon': 'ak47', 'headshot': rng.random() < 0.4},
+                             {'player': location(positions[player]), 'attacker': location(positions[attacker])}, {'player': player, 'attacker': attacker})
+                    alive.discard(player)
+                    standing = set(teams[other] for other in alive)
+                    if len(standing) == 1:
+                        winner = standing.pop()
+
+        if winner is None:
+            #time ran out, a small share of rounds end in a draw
+            winner = rng.choice([2, 3, 3, 1]) if rng.random() < 0.05 else 3
+        tick += 1
+        writeRow(lines, tick, 'round_end', {'winner': winner, 'reason': 9 if winner == 3 else 8, 'message': '#SFUI_Notice_Round_Win'})
+
+    return lines
+
+
+def generateDemos(directory, matches=10, rounds=30, players=10, roundSeconds=(30, 90), seed=0, tickRate=tickRate):
+    #write matches .dat files into directory, returns their paths
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for match in range(matches):
+        rng = random.Random(seed * 100003 + match)
+        path = os.path.join(directory, 'match%04d.dem.dat' % match)
+        with open(path, 'w', encoding='utf8') as fp:
+            fp.write('\n'.join(matchLines(rng, rounds, players, roundSeconds, tickRate)) + '\n')
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic CS:GO .dat files in the importToFile.js format")
+    parser.add_argument('directory')
+    parser.add_argument('--matches', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=30, help="rounds per match")
+    parser.add_argument('--players', type=int, default=10, help="players per match, split evenly between the teams")
+    parser.add_argument('--round-seconds', type=float, nargs=2, default=[30, 90], metavar=('MIN', 'MAX'),
+                        help="round length after freeze time, when a team isn't wiped out first")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tick-rate', type=int, default=tickRate)
+    args = parser.parse_args()
+
+    paths = generateDemos(args.directory, args.matches, args.rounds, args.players, tuple(args.round_seconds), args.seed, args.tick_rate)
+    print("Wrote " + str(len(paths)) + " files to " + args.directory)
+
+
+if __name__ == '__main__':
+    main()
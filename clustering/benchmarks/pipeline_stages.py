@@ -0,0 +1,148 @@
+## Pipeline stage benchmark
+##
+## Generates synthetic matches with generate_demos.py and times every stage of
+## the clustering script on them separately: parse, snapshot join,
+## generateClusters, findClusterWinRates, generateConcaveHulls and the JSON
+## write. Each data size runs in a fresh process, which reports the process's
+## peak RSS after every stage and, with --tracemalloc, the peak memory each
+## stage allocated itself (tracing slows the stages down, so their times are
+## less useful on those runs). With --stream, parsing and the snapshot join are
+## one parseJoin stage that joins every round as it's parsed, as the script does.
+##
+## Usage: python benchmarks/pipeline_stages.py --matches 5 20 80 --json results.json
+## Linux/macOS only (uses the resource module).
+
+import argparse, contextlib, json, multiprocessing, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from csgo_clusters.metrics import peakRss
+
+stageNames = ['parse', 'snapshotJoin', 'generateClusters', 'findClusterWinRates', 'generateConcaveHulls', 'jsonWrite']
+streamStageNames = ['parseJoin'] + stageNames[2:]
+
+
+def runStages(config, queue):
+    import tracemalloc
+    from generate_demos import generateDemos
+    from csgo_clusters.clusters import findClusterWinRates, generateClusters, generateConcaveHulls
+    from csgo_clusters.parse import newParseState, parseFiles, streamRounds
+    from csgo_clusters.records import writePositions
+    from csgo_clusters.snapshots import joinSnapshots, partitionSnapshots, timePeriod
+
+    stages = {}
+    quiet = open(os.devnull, 'w')
+
+    @contextlib.contextmanager
+    def stage(name):
+        if config['tracemalloc']:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(quiet):
+            yield
+        stages[name] = {'seconds': time.perf_counter() - start, 'peakRssBytes': peakRss()}
+        if config['tracemalloc']:
+            stages[name]['peakTracedBytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = generateDemos(os.path.join(directory, 'Data'), config['matches'], config['rounds'], config['players'],
+                              tuple(config['roundSeconds']), config['seed'])
+        dataBytes = sum(os.path.getsize(path) for path in paths)
+
+        if config['stream']:
+            with stage('parseJoin'):
+                periodRecords, tables, endState = joinSnapshots(streamRounds(paths, newParseState(), config['workers']))
+            dictRecords = periodRecords[timePeriod]
+            roundCount = endState['roundCount']
+        else:
+            with stage('parse'):
+                output, playerTeams, playerDeaths, listOfWinningTeams, roundCount = parseFiles(paths, config['workers'])
+
+            with stage('snapshotJoin'):
+                dictRecords, tables = partitionSnapshots(output, playerTeams, playerDeaths, listOfWinningTeams)
+
+        with stage('generateClusters'):
+            dictClusters = {partition: generateClusters(times, **config['clusterOptions']) for partition, times in dictRecords.items()}
+
+        with stage('findClusterWinRates'):
+            dictClusterWinRate = {partition: findClusterWinRates(times, dictClusters[partition]) for partition, times in dictRecords.items()}
+
+        with stage('generateConcaveHulls'):
+            dictClusterShapes = {partition: generateConcaveHulls(times, dictClusters[partition]) for partition, times in dictRecords.items()}
+
+        #nested by partition key like the script's output, with every record's cluster label
+        nested = [{}, {}, {}]
+        for partition, times in dictRecords.items():
+            for bucketTime, records in times.items():
+                records['cluster'] = dictClusters[partition][bucketTime]
+                for d, value in zip(nested, (dictClusterWinRate[partition][bucketTime], records, dictClusterShapes[partition][bucketTime])):
+                    for key in partition:
+                        d = d.setdefault(key, {})
+                    d[bucketTime] = value
+
+        outputBytes = 0
+        with stage('jsonWrite'):
+            for name, d in zip(('clusterWinRates', 'clusterPositions', 'clusterShapes'), nested):
+                with open(os.path.join(directory, name + '.json'), 'w') as fp:
+                    if name == 'clusterPositions':
+                        writePositions(fp, d, tables)
+                    else:
+                        json.dump(d, fp)
+                    outputBytes += fp.tell()
+
+    queue.put({'matches': config['matches'], 'rounds': config['rounds'], 'players': config['players'],
+               'roundSeconds': config['roundSeconds'], 'seed': config['seed'], 'workers': config['workers'],
+               'clusterOptions': config['clusterOptions'], 'dataBytes': dataBytes, 'roundsParsed': roundCount,
+               'points': sum(len(records) for times in dictRecords.values() for records in times.values()),
+               'buckets': sum(len(times) for times in dictRecords.values()), 'outputBytes': outputBytes,
+               'stages': stages})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory of every clustering pipeline stage on synthetic demos")
+    parser.add_argument('--matches', type=int, nargs='+', default=[5, 20], help="one run per match count")
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--round-seconds', type=float, nargs=2, default=[30, 90], metavar=('MIN', 'MAX'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help="parse processes, 1 times the parser on its own")
+    parser.add_argument('--eps', type=float, default=80)
+    parser.add_argument('--min-samples', type=int, default=30)
+    parser.add_argument('--backend', default='default')
+    parser.add_argument('--stream', action='store_true', help="parse and join a round at a time, as the script does")
+    parser.add_argument('--tracemalloc', action='store_true', help="also record the peak memory each stage allocates")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    print("%8s %8s %22s %10s %12s" % ('matches', 'points', 'stage', 'seconds', 'peak RSS MB'))
+    for matches in args.matches:
+        config = {'matches': matches, 'rounds': args.rounds, 'players': args.players, 'roundSeconds': args.round_seconds,
+                  'seed': args.seed, 'workers': args.workers, 'tracemalloc': args.tracemalloc, 'stream': args.stream,
+                  'clusterOptions': {'eps': args.eps, 'minSamples': args.min_samples, 'backend': args.backend}}
+        queue = context.Queue()
+        process = context.Process(target=runStages, args=(config, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            #most likely killed for running out of memory
+            result = {'matches': matches, 'failed': process.exitcode}
+            print("%8d     failed (exit code %s)" % (matches, process.exitcode))
+        else:
+            result = queue.get()
+            for name in (streamStageNames if args.stream else stageNames):
+                measured = result['stages'][name]
+                print("%8d %8d %22s %10.3f %12.1f" % (matches, result['points'], name, measured['seconds'], measured['peakRssBytes'] / 2 ** 20))
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=1)
+
+
+if __name__ == '__main__':
+    main()
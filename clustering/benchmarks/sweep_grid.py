@@ -0,0 +1,117 @@
+## DBSCAN sweep benchmark
+##
+## Times sweepGraph and sweepLabels (see csgo_clusters/sweep.py) labelling a
+## whole eps x minSamples grid on one synthetic spawn-stacked time bucket, and
+## sklearn's DBSCAN run once at --eps/--min-samples, then, with --separate, once
+## for every setting of the grid. Each runs in a fresh process and reports the
+## peak RSS over the RSS after imports, and the sweep and separate runs are
+## reported as a ratio of the single run's time. The sweep's labels are checked
+## against the separate runs when both are run.
+##
+## Usage: python benchmarks/sweep_grid.py --points 20000 100000 --sweep-eps 40 60 80 100 120 --sweep-min-samples 10 30 50 --separate
+## Linux/macOS only (uses the resource module).
+
+import argparse, hashlib, json, multiprocessing, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from csgo_clusters.metrics import peakRss
+from dbscan_backends import spawnBucket
+
+
+def labelsDigest(labels):
+    return hashlib.sha1(labels.astype('<i8').tobytes()).hexdigest()
+
+
+def runSingle(config, queue):
+    from sklearn.cluster import DBSCAN
+
+    points = spawnBucket(config['points'], spread=config['spread'])
+    baseline = peakRss()
+    start = time.perf_counter()
+    DBSCAN(eps=config['eps'], min_samples=config['minSamples']).fit(points)
+    queue.put({'seconds': time.perf_counter() - start, 'peakRssBytes': peakRss() - baseline})
+
+
+def runSeparate(config, queue):
+    from sklearn.cluster import DBSCAN
+
+    points = spawnBucket(config['points'], spread=config['spread'])
+    baseline = peakRss()
+    digests = {}
+    start = time.perf_counter()
+    for minSamples in sorted(config['minSamplesValues']):
+        for eps in sorted(config['epsValues']):
+            digests[str((eps, minSamples))] = labelsDigest(DBSCAN(eps=eps, min_samples=minSamples).fit_predict(points))
+    queue.put({'seconds': time.perf_counter() - start, 'peakRssBytes': peakRss() - baseline, 'digests': digests})
+
+
+def runSweep(config, queue):
+    from csgo_clusters.sweep import sweepGraph, sweepLabels
+
+    points = spawnBucket(config['points'], spread=config['spread'])
+    baseline = peakRss()
+    digests = {}
+    start = time.perf_counter()
+    graph = sweepGraph(points, sorted(config['epsValues']), sorted(config['minSamplesValues']))
+    graphSeconds = time.perf_counter() - start
+    for eps, minSamples, labels in sweepLabels(graph):
+        digests[str((eps, minSamples))] = labelsDigest(labels)
+    queue.put({'seconds': time.perf_counter() - start, 'graphSeconds': graphSeconds, 'peakRssBytes': peakRss() - baseline,
+               'keptPairs': int(graph['tree'].shape[1] + graph['border'].shape[1]), 'digests': digests})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and peak memory of a DBSCAN parameter sweep against single DBSCAN runs")
+    parser.add_argument('--points', type=int, nargs='+', default=[20000])
+    parser.add_argument('--spread', type=float, default=150, help="standard deviation of the spawn stacks in map units")
+    parser.add_argument('--eps', type=float, default=80, help="eps of the single DBSCAN run")
+    parser.add_argument('--min-samples', type=int, default=30, help="minSamples of the single DBSCAN run")
+    parser.add_argument('--sweep-eps', type=float, nargs='+', default=[40, 50, 60, 70, 80, 90, 100, 110, 120, 130])
+    parser.add_argument('--sweep-min-samples', type=int, nargs='+', default=[10, 20, 30, 40, 50])
+    parser.add_argument('--separate', action='store_true', help="also run DBSCAN once for every setting of the grid")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    runs = [('single', runSingle), ('sweep', runSweep)] + ([('separate', runSeparate)] if args.separate else [])
+    settings = len(args.sweep_eps) * len(args.sweep_min_samples)
+    results = []
+
+    print("%10s %10s %10s %12s %10s" % ('points', 'run', 'seconds', 'peak MB', 'x single'))
+    for pointCount in args.points:
+        config = {'points': pointCount, 'spread': args.spread, 'eps': args.eps, 'minSamples': args.min_samples,
+                  'epsValues': args.sweep_eps, 'minSamplesValues': args.sweep_min_samples}
+        single = None
+        digests = {}
+        for name, function in runs:
+            queue = context.Queue()
+            process = context.Process(target=function, args=(config, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                #most likely killed for running out of memory
+                print("%10d %10s     failed (exit code %s)" % (pointCount, name, process.exitcode))
+                results.append({'points': pointCount, 'run': name, 'failed': process.exitcode})
+                continue
+
+            result = queue.get()
+            if name == 'single':
+                single = result['seconds']
+            if 'digests' in result:
+                digests[name] = result.pop('digests')
+            print("%10d %10s %10.3f %12.1f %10.1f" % (pointCount, name + (' x' + str(settings) if name != 'single' else ''), result['seconds'],
+                                                     result['peakRssBytes'] / 2 ** 20, result['seconds'] / single if single else float('nan')))
+            results.append(dict(result, points=pointCount, run=name, settings=settings, ratio=result['seconds'] / single if single else None))
+
+        if len(digests) == 2:
+            print("%10d sweep labels %s the separate runs'" % (pointCount, 'match' if digests['sweep'] == digests['separate'] else "DON'T match"))
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=1)
+
+
+if __name__ == '__main__':
+    main()
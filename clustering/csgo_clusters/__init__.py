@@ -0,0 +1,6 @@
+## CS:GO clustering helpers
+##
+## Importable stages used by "CSGO Example Clustering Script.py". They live in a
+## package rather than the script itself so worker processes can import them.
+## run.py has whole runs as functions and cli.py the command line that calls
+## them (python -m csgo_clusters --help).
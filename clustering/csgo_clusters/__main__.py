@@ -0,0 +1,5 @@
+## python -m csgo_clusters, see cli.py
+
+from .cli import main
+
+main()
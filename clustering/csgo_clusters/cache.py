@@ -0,0 +1,192 @@
+## Columnar cache of parsed .dat files
+##
+## Every parsed file is kept as a directory of typed .npy columns plus a small
+## meta.json holding the source file's path, size and mtime and the trace period
+## it was parsed with. Files that haven't changed are read back from their
+## columns instead of being parsed again, so trying new clustering parameters
+## doesn't mean re-reading every demo's text and JSON. The columns are turned
+## back into the same parse result a fresh parse gives, so a cached file costs
+## as much memory as a parsed one, only the parsing is saved.
+
+import hashlib, json, os, shutil
+import numpy as np
+
+from .records import coordinateFlags, isColumnarPosition, xIsInt, yIsInt, zIsInt
+
+cacheVersion = 4
+
+
+def cacheEntryDirectory(cacheDirectory, path):
+    return os.path.join(cacheDirectory, hashlib.sha1(os.path.abspath(path).encode('utf8')).hexdigest())
+
+
+def sourceStamp(path, tracePeriod):
+    stat = os.stat(path)
+    return {'version': cacheVersion, 'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'tracePeriod': tracePeriod}
+
+
+def resultToColumns(result):
+    #flatten a parseFile result into typed columns, or None if it holds something the columns can't represent
+
+    files = [result['filename']]
+    fileIndex = {result['filename']: 0}
+
+    snapshotTick = []
+    snapshotRound = []
+    snapshotStart = [0]
+    rounds, players, fileNumbers, xs, ys, zs, flags = [], [], [], [], [], [], []
+
+    for tick, positions, snapshotRoundNumber in result['output']:
+        snapshotTick.append(tick)
+        snapshotRound.append(snapshotRoundNumber)
+        for player, (position, roundNumber, filename) in positions.items():
+            if (type(player) is not int) or not isColumnarPosition(position):
+                return None
+            if filename not in fileIndex:
+                fileIndex[filename] = len(files)
+                files.append(filename)
+            rounds.append(roundNumber)
+            players.append(player)
+            fileNumbers.append(fileIndex[filename])
+            xs.append(position['x'])
+            ys.append(position['y'])
+            zs.append(position['z'])
+            flags.append(coordinateFlags(position))
+        snapshotStart.append(len(rounds))
+
+    teamRound = [r for r, player in result['playerTeams'].keys()]
+    teamPlayer = [player for r, player in result['playerTeams'].keys()]
+    teamNumber = list(result['playerTeams'].values())
+
+    deathRound = [r for r, player in result['playerDeaths'].keys()]
+    deathPlayer = [player for r, player in result['playerDeaths'].keys()]
+    deathTick = [tick for tick, relativeTick in result['playerDeaths'].values()]
+    deathRelativeTick = [relativeTick for tick, relativeTick in result['playerDeaths'].values()]
+
+    if not all(type(value) is int for value in teamPlayer + teamNumber + deathPlayer + list(result['listOfWinningTeams'].values())):
+        return None
+
+    columns = {
+        'snapshotTick': np.array(snapshotTick, dtype=np.int64),
+        'snapshotRound': np.array(snapshotRound, dtype=np.int32),
+        'snapshotStart': np.array(snapshotStart, dtype=np.int64),
+        'round': np.array(rounds, dtype=np.int32),
+        'player': np.array(players, dtype=np.int32),
+        'file': np.array(fileNumbers, dtype=np.int32),
+        'x': np.array(xs, dtype=np.float64),
+        'y': np.array(ys, dtype=np.float64),
+        'z': np.array(zs, dtype=np.float64),
+        'coords': np.array(flags, dtype=np.uint8),
+        'teamRound': np.array(teamRound, dtype=np.int32),
+        'teamPlayer': np.array(teamPlayer, dtype=np.int32),
+        'teamNumber': np.array(teamNumber, dtype=np.int32),
+        'deathRound': np.array(deathRound, dtype=np.int32),
+        'deathPlayer': np.array(deathPlayer, dtype=np.int32),
+        'deathTick': np.array(deathTick, dtype=np.int64),
+        'deathRelativeTick': np.array(deathRelativeTick, dtype=np.int64),
+        'winRound': np.array(list(result['listOfWinningTeams'].keys()), dtype=np.int32),
+        'winner': np.array(list(result['listOfWinningTeams'].values()), dtype=np.int32),
+    }
+
+    #the state a file stops in is only needed when it stops mid-round, keep it as JSON next to the columns
+    endState = dict(result['endState'])
+    endState['mostRecentPositions'] = [[player, entry] for player, entry in endState['mostRecentPositions'].items()]
+
+    meta = {'filename': result['filename'], 'roundBase': result['roundBase'], 'files': files, 'endState': endState}
+    return columns, meta
+
+
+def columnsToResult(columns, meta):
+    #rebuild the parseFile result the rest of the script works with
+
+    files = meta['files']
+    snapshotTick = columns['snapshotTick'].tolist()
+    snapshotRound = columns['snapshotRound'].tolist()
+    snapshotStart = columns['snapshotStart'].tolist()
+    rounds = columns['round'].tolist()
+    players = columns['player'].tolist()
+    fileNumbers = columns['file'].tolist()
+    xs = columns['x'].tolist()
+    ys = columns['y'].tolist()
+    zs = columns['z'].tolist()
+    flags = columns['coords'].tolist()
+
+    output = []
+    for n, tick in enumerate(snapshotTick):
+        positions = {}
+        for i in range(snapshotStart[n], snapshotStart[n + 1]):
+            flag = flags[i]
+            position = {'x': int(xs[i]) if flag & xIsInt else xs[i],
+                        'y': int(ys[i]) if flag & yIsInt else ys[i],
+                        'z': int(zs[i]) if flag & zIsInt else zs[i]}
+            positions[players[i]] = [position, rounds[i], files[fileNumbers[i]]]
+        output.append([tick, positions, snapshotRound[n]])
+
+    playerTeams = dict(zip(zip(columns['teamRound'].tolist(), columns['teamPlayer'].tolist()), columns['teamNumber'].tolist()))
+    playerDeaths = dict(zip(zip(columns['deathRound'].tolist(), columns['deathPlayer'].tolist()),
+                            zip(columns['deathTick'].tolist(), columns['deathRelativeTick'].tolist())))
+
+    listOfWinningTeams = dict(zip(columns['winRound'].tolist(), columns['winner'].tolist()))
+
+    endState = dict(meta['endState'])
+    endState['mostRecentPositions'] = {player: entry for player, entry in endState['mostRecentPositions']}
+
+    return {'filename': meta['filename'], 'roundBase': meta['roundBase'], 'output': output,
+            'playerTeams': playerTeams, 'playerDeaths': playerDeaths, 'listOfWinningTeams': listOfWinningTeams,
+            'endState': endState}
+
+
+def readCachedColumns(cacheDirectory, path, tracePeriod):
+    #the cached columns for path, or None if there is no cache entry for this version of the file
+    entry = cacheEntryDirectory(cacheDirectory, path)
+    try:
+        with open(os.path.join(entry, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('source') != sourceStamp(path, tracePeriod):
+        return None
+
+    columns = {}
+    for name in meta['columns']:
+        columns[name] = np.load(os.path.join(entry, name + '.npy'))
+    return columns, meta
+
+
+def writeCachedColumns(cacheDirectory, path, columns, meta, stamp):
+    entry = cacheEntryDirectory(cacheDirectory, path)
+    temporary = entry + '.tmp' + str(os.getpid())
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+
+    for name, column in columns.items():
+        np.save(os.path.join(temporary, name + '.npy'), column)
+
+    meta = dict(meta)
+    meta['columns'] = list(columns.keys())
+    meta['source'] = stamp
+    with open(os.path.join(temporary, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(entry, ignore_errors=True)
+    os.rename(temporary, entry)
+
+
+def readCachedFile(cacheDirectory, path, tracePeriod):
+    cached = readCachedColumns(cacheDirectory, path, tracePeriod)
+    if cached is None:
+        return None
+    return columnsToResult(*cached)
+
+
+def writeCachedFile(cacheDirectory, path, result, stamp):
+    #stamp is taken before parsing, so a file edited mid-parse is parsed again next time
+    #returns False when the result can't be stored exactly, in which case the file is just parsed every run
+    converted = resultToColumns(result)
+    if converted is None:
+        return False
+    columns, meta = converted
+    writeCachedColumns(cacheDirectory, path, columns, meta, stamp)
+    return True
@@ -0,0 +1,186 @@
+## Command line
+##
+## python -m csgo_clusters <command>, from the directory holding csgo_clusters:
+##   ingest   parse new .dat files into a state directory and recluster the time buckets they change
+##   export   write the output files from a state directory
+##   cluster  parse, cluster and write in one go, through a state directory if --state is given
+##   info     what a state directory or output directory holds
+## e.g. python -m csgo_clusters cluster --input Data --output Output --map de_dust2 --eps 80 --min-samples 30
+##
+## With --map every directory given is that map's directory inside it, so one
+## set of directories holds every map, e.g. Data/de_dust2 and Output/de_dust2.
+##
+## Only argparse, json and os are imported up front, the stages (and NumPy,
+## SciPy, sklearn and Shapely with them) are imported by the command that runs
+## them, so --help and info don't wait on them.
+
+import argparse, json, os
+
+clusterBackends = ('default', 'graph', 'grid') #clusters.clusterBackends, which can't be imported without sklearn
+profileStages = ['parseJoin', 'parse', 'snapshotJoin', 'cluster', 'readState', 'sweep', 'track', 'write', 'buckets']
+
+
+def mapDirectory(directory, mapName):
+    if directory is None or mapName is None:
+        return directory
+    return os.path.join(directory, mapName)
+
+
+def clusterOptions(args):
+    return {'eps': args.eps, 'minSamples': args.minSamples, 'backend': args.backend}
+
+
+def outputOptions(args):
+    #keyword arguments of run.export and run.cluster
+    return {'sharded': args.sharded, 'compression': args.compression,
+            'shapeOptions': {'tolerance': args.shapeTolerance, 'precision': args.shapePrecision, 'binary': args.shapeBinary},
+            'trackOptions': {'searchDistance': args.trackDistance} if args.trackDistance is not None else None,
+            'sweepOptions': sweepOptions(args)}
+
+
+def sweepOptions(args):
+    #sweepPartitions' own values for whichever of eps and minSamples isn't given, None unless one is
+    if args.sweepEps is None and args.sweepMinSamples is None:
+        return None
+    options = {}
+    if args.sweepEps is not None:
+        options['eps'] = args.sweepEps
+    if args.sweepMinSamples is not None:
+        options['minSamples'] = args.sweepMinSamples
+    return options
+
+
+def printSummary(summary):
+    from .snapshots import periodName
+    print("Metrics written, slowest time buckets:")
+    for bucket in summary['slowestBuckets'][:5]:
+        print("  " + str(bucket['partition']) + " " + str(bucket['time']) + " (" + periodName(bucket['period']) + "): " + str(round(bucket['seconds'], 2)) + "s, "
+              + str(bucket['points']) + " points, " + str(bucket['alphaSteps']) + " alpha steps")
+
+
+def runIngest(args):
+    from .run import ingest
+    ingest(mapDirectory(args.input, args.map), mapDirectory(args.state, args.map), args.workers, mapDirectory(args.cache, args.map),
+           clusterOptions(args), args.periods)
+
+
+def runExport(args):
+    from .run import export
+    export(mapDirectory(args.state, args.map), mapDirectory(args.output, args.map), args.periods, workers=args.workers, **outputOptions(args))
+
+
+def runCluster(args):
+    from .run import cluster
+    cluster(mapDirectory(args.input, args.map), mapDirectory(args.output, args.map), args.workers, mapDirectory(args.cache, args.map),
+            mapDirectory(args.state, args.map), mapDirectory(args.spill, args.map), clusterOptions(args), args.periods, **outputOptions(args))
+
+
+def runInfo(args):
+    #from the JSON files alone
+    for directory in (mapDirectory(args.state, args.map), mapDirectory(args.output, args.map)):
+        if directory is None:
+            continue
+
+        statePath = os.path.join(directory, 'state.json')
+        if os.path.exists(statePath):
+            with open(statePath, 'r') as fp:
+                state = json.load(fp)
+            print(directory + ": state of " + str(len(state['files'])) + " files, " + str(state['endState']['roundCount']) + " rounds, "
+                  + str(len(state['buckets'])) + " time buckets")
+            print("  clusterOptions " + json.dumps(state['clusterOptions']) + ", partitionBy " + json.dumps(state['partitionBy'])
+                  + ", periods " + json.dumps(state['periods']))
+
+        manifestPath = os.path.join(directory, 'manifest.json')
+        if os.path.exists(manifestPath):
+            with open(manifestPath, 'r') as fp:
+                manifest = json.load(fp)
+
+            def countTimes(times):
+                return len(times) if isinstance(times, list) else sum(countTimes(nested) for nested in times.values())
+
+            print(directory + ": sharded output of " + str(countTimes(manifest['times'])) + " time buckets, partitionBy "
+                  + json.dumps(manifest['partitionBy']) + ", period " + str(manifest['timePeriod']) + "s, compression " + str(manifest['compression']))
+
+        files = sorted(filename for filename in os.listdir(directory) if filename.startswith('cluster')) if os.path.isdir(directory) else []
+        for filename in files:
+            print("  " + filename + " " + str(os.path.getsize(os.path.join(directory, filename))) + " bytes")
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog='python -m csgo_clusters', description="Cluster CS:GO player positions into clusterWinRates/Positions/Shapes.json")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--map', help="use every directory's subdirectory of this name, e.g. de_dust2")
+    common.add_argument('--workers', type=int, help="processes used to parse files and cluster, every core if not given")
+    common.add_argument('--metrics', help="directory to write metrics.json and an events.jsonl progress log to")
+    common.add_argument('--profile', nargs='+', default=[], choices=profileStages,
+                        help="stages to run under cProfile, 'buckets' profiles every time bucket on its own (profiles go in the metrics directory)")
+
+    inputs = argparse.ArgumentParser(add_help=False)
+    inputs.add_argument('--input', '-i', default='Data', help="directory of .dat files (default Data)")
+    inputs.add_argument('--cache', help="directory to keep parsed files in, so they're only parsed again when they change")
+
+    clustering = argparse.ArgumentParser(add_help=False)
+    clustering.add_argument('--eps', type=float, default=80, help="DBSCAN eps in map units (default 80)")
+    clustering.add_argument('--min-samples', dest='minSamples', type=int, default=30, help="DBSCAN minSamples (default 30)")
+    clustering.add_argument('--backend', choices=clusterBackends, default='default', help="DBSCAN backend, see csgo_clusters/clusters.py")
+
+    periods = argparse.ArgumentParser(add_help=False)
+    periods.add_argument('--periods', type=int, nargs='+', help="seconds per time bucket, the first period's files are the ones the front-end reads (default 2)")
+
+    outputs = argparse.ArgumentParser(add_help=False)
+    outputs.add_argument('--output', '-o', default='.', help="directory to write the output files to (default the current directory)")
+    outputs.add_argument('--sharded', action='store_true', help="write manifest.json and a shard per time bucket instead of the three JSON files")
+    outputs.add_argument('--compression', choices=['gzip'], help="compress every shard")
+    outputs.add_argument('--shape-tolerance', dest='shapeTolerance', type=float, help="simplify every shape to within this many map units")
+    outputs.add_argument('--shape-precision', dest='shapePrecision', type=int, help="decimal places shape coordinates are rounded to, 0 for whole map units")
+    outputs.add_argument('--shape-binary', dest='shapeBinary', action='store_true',
+                         help="also write clusterShapes.bin, delta-encoded int16 vertices, needs --shape-precision 0 or 1 to fit a map, not with --sharded")
+    outputs.add_argument('--track-distance', dest='trackDistance', type=float,
+                         help="link clusters to the next time bucket's clusters within this many map units and write clusterTracks.json")
+    outputs.add_argument('--sweep-eps', dest='sweepEps', type=float, nargs='+', help="eps values to score instead of clustering, writes clusterSweep.json")
+    outputs.add_argument('--sweep-min-samples', dest='sweepMinSamples', type=int, nargs='+', help="minSamples values to score with --sweep-eps")
+
+    ingest = commands.add_parser('ingest', parents=[common, inputs, clustering, periods], help="parse new .dat files into a state directory")
+    ingest.add_argument('--state', required=True, help="directory the clustering state is kept in")
+    ingest.set_defaults(function=runIngest)
+
+    export = commands.add_parser('export', parents=[common, periods, outputs], help="write the output files from a state directory")
+    export.add_argument('--state', required=True, help="directory the clustering state is kept in")
+    export.set_defaults(function=runExport)
+
+    cluster = commands.add_parser('cluster', parents=[common, inputs, clustering, periods, outputs], help="parse, cluster and write in one go")
+    cluster.add_argument('--state', help="directory to keep the clustering state in, so only new files are parsed and reclustered")
+    cluster.add_argument('--spill', help="directory to keep the points of every time bucket in until they're clustered instead of memory")
+    cluster.set_defaults(function=runCluster)
+
+    info = commands.add_parser('info', help="what a state directory or output directory holds")
+    info.add_argument('--map', help="use every directory's subdirectory of this name, e.g. de_dust2")
+    info.add_argument('--state', help="state directory")
+    info.add_argument('--output', '-o', default='.', help="output directory (default the current directory)")
+    info.set_defaults(function=runInfo)
+
+    return parser
+
+
+def main(argv=None):
+    parser = buildParser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'sharded', False) and args.shapeBinary:
+        parser.error("--shape-binary can't be used with --sharded")
+    if args.command == 'info':
+        args.function(args)
+        return
+
+    #export writes every period its state has unless told otherwise, the others cluster timePeriod in snapshots.py
+    if args.command != 'export' and args.periods is None:
+        args.periods = [2]
+
+    from .metrics import finishRun, startRun
+    startRun(args.metrics or ("Metrics" if args.profile else None), args.profile)
+    args.function(args)
+    summary = finishRun()
+    if args.metrics or args.profile:
+        printSummary(summary)
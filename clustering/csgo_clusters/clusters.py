@@ -0,0 +1,223 @@
+## Clustering stages
+##
+## DBSCAN over every time bucket, then the win rate and concave hull of each
+## cluster. Points are grouped by label in a single pass over NumPy arrays
+## instead of rescanning every point once per cluster.
+##
+## clusterBucket, bucketWinRates and bucketHulls work on one time bucket, the
+## generate*/find* functions run them over a dict of time buckets of point
+## records (see records.py).
+##
+## clusterBucket has three backends:
+##   'default'  sklearn's DBSCAN on the raw points
+##   'graph'    the same labels, from KD-tree neighbour queries run in chunks and collapsed into a
+##              graph of grid cells, so memory doesn't grow with the number of neighbour pairs
+##   'grid'     approximate, points are binned into gridSize cells and the cell centroids are
+##              clustered with their point counts as sample_weight
+
+import numpy as np
+
+import shapely.geometry as geometry
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.cluster import DBSCAN
+from sklearn.neighbors import KDTree
+
+from .hulls import concaveHull
+from .records import recordPoints
+
+clusterBackends = ('default', 'graph', 'grid')
+
+
+def graphLabels(points, eps, minSamples, chunkEntries=1000000):
+    #exact DBSCAN labels and core point flags without holding every point's neighbour list at once
+    #core points are found from KD-tree neighbour counts, then bucketed into cells small enough that every pair of
+    #points in a cell are neighbours, so clusters are just connected groups of cells. The neighbour pairs needed to
+    #join cells are queried a chunk at a time (at most about chunkEntries of them) and collapsed to cell pairs straight
+    #away, which is what keeps the memory down
+    labels = np.full(len(points), -1, dtype=np.intp)
+    if len(points) == 0:
+        return labels, np.zeros(0, dtype=bool)
+
+    #neighbour counts (including the point itself) find the core points
+    counts = KDTree(points).query_radius(points, eps, count_only=True)
+    core = counts >= minSamples
+    coreIndex = np.flatnonzero(core)
+    if len(coreIndex) == 0:
+        return labels, core
+    corePoints = points[coreIndex]
+
+    #a cell's diagonal is just under eps
+    cells = np.floor(corePoints / (eps / np.sqrt(2) * (1 - 1e-9))).astype(np.int64)
+    cells -= cells.min(axis=0)
+    cellKeys, cellOfCore = np.unique(cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1], return_inverse=True)
+    cellCount = len(cellKeys)
+
+    #pairs of cells joined by at least one pair of neighbouring core points
+    coreTree = KDTree(corePoints)
+    #chunk ends, from one running total of the neighbour counts
+    coreTotals = np.cumsum(np.minimum(counts[coreIndex], len(coreIndex)))
+    cellPairs = []
+    start = 0
+    while start < len(coreIndex):
+        taken = coreTotals[start - 1] if start else 0
+        end = max(start + 1, int(np.searchsorted(coreTotals, taken + chunkEntries, side='right')))
+        neighbours = coreTree.query_radius(corePoints[start:end], eps)
+        lengths = np.fromiter((len(n) for n in neighbours), dtype=np.int64, count=len(neighbours))
+        fromCells = np.repeat(cellOfCore[start:end], lengths)
+        toCells = cellOfCore[np.concatenate(neighbours)]
+        joined = fromCells < toCells
+        cellPairs.append(np.unique(fromCells[joined] * cellCount + toCells[joined]))
+        start = end
+
+    cellPairs = np.unique(np.concatenate(cellPairs))
+    cellGraph = csr_matrix((np.ones(len(cellPairs), dtype=np.int8), (cellPairs // cellCount, cellPairs % cellCount)), shape=(cellCount, cellCount))
+    componentCount, cellComponents = connected_components(cellGraph, directed=False)
+    components = cellComponents[cellOfCore]
+
+    #number clusters by their lowest core point, the order sklearn finds them in
+    firstPosition = np.unique(components, return_index=True)[1]
+    rank = np.empty(componentCount, dtype=np.intp)
+    rank[np.argsort(firstPosition)] = np.arange(componentCount)
+    coreLabels = rank[components]
+    labels[coreIndex] = coreLabels
+
+    #border points take the lowest numbered cluster among their core neighbours, they have fewer than minSamples of them
+    nonCore = np.flatnonzero(~core)
+    if len(nonCore):
+        neighbours = coreTree.query_radius(points[nonCore], eps)
+        lengths = np.fromiter((len(n) for n in neighbours), dtype=np.int64, count=len(neighbours))
+        lowest = np.full(len(nonCore), len(coreIndex), dtype=np.intp)
+        np.minimum.at(lowest, np.repeat(np.arange(len(nonCore)), lengths), coreLabels[np.concatenate(neighbours)])
+        border = lengths > 0
+        labels[nonCore[border]] = lowest[border]
+    return labels, core
+
+
+def gridLabels(points, eps, minSamples, gridSize):
+    #approximate DBSCAN labels: cluster the centroid of every gridSize cell, weighted by how many points fell in it
+    #a point is core if its cell's centroid was
+    cells = np.floor(points / gridSize).astype(np.int64)
+    cells -= cells.min(axis=0)
+    keys = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+    uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+
+    weights = np.bincount(inverse)
+    centroids = np.stack([np.bincount(inverse, weights=points[:, 0]), np.bincount(inverse, weights=points[:, 1])], axis=1) / weights[:, None]
+
+    db = DBSCAN(eps=eps, min_samples=minSamples).fit(centroids, sample_weight=weights)
+    core = np.zeros(len(centroids), dtype=bool)
+    core[db.core_sample_indices_] = True
+    return db.labels_[inverse], core[inverse]
+
+
+def clusterBucket(points, eps=80, minSamples=30, backend='default', gridSize=20.0, chunkEntries=1000000):
+    #DBSCAN labels for one time bucket and which points were core points, backend is one of clusterBackends
+    #chunkEntries caps how many neighbour pairs the graph backend holds at once
+    points = np.asarray(points, dtype=np.float64)
+
+    if backend == 'default':
+        db = DBSCAN(eps=eps, min_samples=minSamples,).fit(points)
+        core = np.zeros(len(points), dtype=bool)
+        core[db.core_sample_indices_] = True
+        return db.labels_, core
+
+    if backend == 'graph':
+        return graphLabels(points, eps, minSamples, chunkEntries)
+
+    if backend == 'grid':
+        return gridLabels(points, eps, minSamples, gridSize)
+
+    raise ValueError("unknown clustering backend: " + str(backend))
+
+
+def groupByLabel(labels):
+    #sorted unique labels, each point's index into them, and the points of each label (in their original order)
+    #points of uniqueLabels[i] are order[bounds[i]:bounds[i + 1]]
+    uniqueLabels, inverse = np.unique(labels, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(uniqueLabels)))])
+    return uniqueLabels, inverse, order, bounds
+
+
+def bucketWinRates(labels, wins, time):
+    #win % of every cluster in one time bucket, wins holds 1/0/-1 for win/draw/loss aligned with labels
+    labels = np.asarray(labels)
+    wins = np.asarray(wins)
+
+    uniqueLabels, inverse = np.unique(labels, return_inverse=True)
+    clusterCount = len(uniqueLabels)
+
+    #win/loss/draw counts of every cluster at once
+    countTotal = np.bincount(inverse, minlength=clusterCount).tolist()
+    countWin = np.bincount(inverse[wins == 1], minlength=clusterCount).tolist()
+    countDraw = np.bincount(inverse[wins == 0], minlength=clusterCount).tolist()
+    countLoss = np.bincount(inverse[wins == -1], minlength=clusterCount).tolist()
+
+    winRates = {}
+    for i, cluster in enumerate(uniqueLabels.tolist()):
+        #now find win %
+        #add this to a dictionary for this time
+        if (countWin[i] + countLoss[i] + countDraw[i] != countTotal[i]):
+            raise Exception("wins/losses/draws don't add up for time: " + str(time))
+
+        winRates[str(cluster)] = countWin[i] / countTotal[i] * 100
+
+    return winRates
+
+
+def bucketHulls(points, labels, time, hullStats=None):
+    #concave hull of every cluster in one time bucket, as lists of exterior coordinates keyed by str(label)
+    #if hullStats is a list, the points, alpha and alpha steps of every cluster's hull are appended to it
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    uniqueLabels, inverse, order, bounds = groupByLabel(np.asarray(labels))
+    convexHulls = {}
+
+    for i, cluster in enumerate(uniqueLabels.tolist()):
+        if (cluster != -1): #if not outliers which have no convex hull
+            pointsToInclude = points[order[bounds[i]:bounds[i + 1]]]
+
+            if (len(pointsToInclude) > 2):
+                #now find concave hull, lowering alpha until the shape is a single polygon
+                concave_hull, alphaVal, alphaSteps = concaveHull(pointsToInclude, alpha=0.01, alphaDecay=0.05)
+                if (alphaVal is None):
+                    print("no single concave hull for cluster " + str(cluster) + " at time " + str(time) + ", using convex hull")
+                if hullStats is not None:
+                    hullStats.append({'cluster': cluster, 'points': len(pointsToInclude), 'alpha': alphaVal, 'alphaSteps': alphaSteps})
+                if (type(concave_hull) is not geometry.polygon.Polygon):
+                    #points are all on a line so there is no shape to draw
+                    continue
+
+                convexHulls[str(cluster)] = list(concave_hull.exterior.coords)
+
+    return convexHulls
+
+
+def generateClusters(dictRecords, **clusterOptions):
+    #labels for every time bucket of point records, clusterOptions are passed on to clusterBucket, e.g. backend='graph'
+    dictClusters = {}
+    for key in dictRecords.keys():
+        dictClusters[key] = clusterBucket(recordPoints(dictRecords[key]), **clusterOptions)[0]
+
+    return dictClusters
+
+
+def findClusterWinRates(dictRecords, dictClusters):
+    #for each cluster at a time, determine win probability
+    dictClusterWinRate = {}
+    for time in dictRecords.keys():
+        dictClusterWinRate[time] = bucketWinRates(dictClusters[time], dictRecords[time]['win'], time)
+
+    print("Finished calculating win rates")
+    return dictClusterWinRate
+
+
+def generateConcaveHulls(dictRecords, dictClusters):
+
+    ##now produce concave hull for each cluster at times
+    dictClusterShapes = {}
+    for time in dictRecords.keys():
+        dictClusterShapes[time] = bucketHulls(recordPoints(dictRecords[time]), dictClusters[time], time)
+
+    print("Finished finding cluster shapes")
+    return dictClusterShapes
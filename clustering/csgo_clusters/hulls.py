@@ -0,0 +1,109 @@
+## Concave hulls of clusters
+##
+## Alpha shapes over the Delaunay triangulation of a cluster's points, computed
+## for every triangle at once with NumPy rather than one triangle at a time.
+## concaveHull triangulates a cluster once and finds the alpha to use from the
+## triangles sorted by circumradius, instead of rebuilding the shape per guess.
+
+import numpy as np
+
+import shapely.geometry as geometry
+from shapely.ops import polygonize, unary_union
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import Delaunay, QhullError
+
+
+def circumradii(points, triangles):
+    #circumradius of every triangle, inf for degenerate (zero area) triangles
+    pa = points[triangles[:, 0]]
+    pb = points[triangles[:, 1]]
+    pc = points[triangles[:, 2]]
+
+    # Lengths of sides of triangles
+    a = np.hypot(*(pa - pb).T)
+    b = np.hypot(*(pb - pc).T)
+    c = np.hypot(*(pc - pa).T)
+
+    # Area of triangles from the cross product, which unlike Heron's formula can't go negative on slivers
+    area = np.abs((pb[:, 0] - pa[:, 0]) * (pc[:, 1] - pa[:, 1]) - (pb[:, 1] - pa[:, 1]) * (pc[:, 0] - pa[:, 0])) / 2.0
+
+    circum_r = np.full(len(triangles), np.inf)
+    nonDegenerate = area > 0
+    circum_r[nonDegenerate] = a[nonDegenerate] * b[nonDegenerate] * c[nonDegenerate] / (4.0 * area[nonDegenerate])
+    return circum_r
+
+
+def boundaryEdges(triangles, pointCount):
+    #edges used by exactly one of the given triangles, i.e. the outline of their union
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges.sort(axis=1)
+
+    #pack each edge into a single integer so counting is one np.unique call
+    keys = edges[:, 0].astype(np.int64) * pointCount + edges[:, 1]
+    uniqueKeys, counts = np.unique(keys, return_counts=True)
+    boundary = uniqueKeys[counts == 1]
+    return np.stack([boundary // pointCount, boundary % pointCount], axis=1)
+
+
+def triangleUnion(points, triangles):
+    # Only the outline is needed, interior edges shared by two triangles don't change the union
+    edge_points = points[boundaryEdges(triangles, len(points))]
+    m = geometry.MultiLineString(list(edge_points))
+    return unary_union(list(polygonize(m))), edge_points
+
+
+def touchingGroups(triangles, pointCount):
+    #number of groups the triangles form when ones sharing a corner are joined
+    if len(triangles) == 0:
+        return 0
+    rows = np.concatenate([triangles[:, 0], triangles[:, 0]])
+    columns = np.concatenate([triangles[:, 1], triangles[:, 2]])
+    graph = csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, columns)), shape=(pointCount, pointCount))
+    labels = connected_components(graph, directed=False)[1]
+    return len(np.unique(labels[triangles[:, 0]]))
+
+
+def concaveHull(points, alpha=0.01, alphaDecay=0.05, maxSteps=200):
+    #the alpha shape for the first of alpha, alpha*(1-alphaDecay), alpha*(1-alphaDecay)^2... that is a single Polygon
+    #returns the hull, the alpha used (None if it fell back to the convex hull) and how many alphas were stepped past
+
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 4:
+        # If there is a triangle, no need to find an alpha shape.
+        return geometry.MultiPoint(points).convex_hull, alpha, 0
+
+    try:
+        tri = Delaunay(points)
+    except QhullError:
+        #all points on a line, there is no area to find a shape for
+        return geometry.MultiPoint(points).convex_hull, None, 0
+
+    #most clusters are a Polygon at the first alpha, so that's tried before anything is sorted
+    circum_r = circumradii(points, tri.simplices)
+    concave_hull, edge_points = triangleUnion(points, tri.simplices[circum_r < 1.0 / alpha])
+    if type(concave_hull) is geometry.polygon.Polygon:
+        return concave_hull, alpha, 0
+
+    #lowering alpha only ever adds triangles, in order of circumradius, so every alpha's shape is a prefix of this order
+    order = np.argsort(circum_r, kind='stable')
+    sortedRadii = circum_r[order]
+    tried = {np.searchsorted(sortedRadii, 1.0 / alpha, side='left')}
+
+    alphaVal = alpha
+    for step in range(1, maxSteps):
+        alphaVal -= alphaVal * alphaDecay
+        accepted = np.searchsorted(sortedRadii, 1.0 / alphaVal, side='left')
+        if accepted in tried:
+            continue
+        tried.add(accepted)
+
+        #only build the shape once the accepted triangles all touch, groups joined at just a corner can still make
+        #one polygon when together they enclose an area polygonize fills in, so the shape's type is the final check
+        triangles = tri.simplices[order[:accepted]]
+        if touchingGroups(triangles, len(points)) == 1:
+            concave_hull, edge_points = triangleUnion(points, triangles)
+            if type(concave_hull) is geometry.polygon.Polygon:
+                return concave_hull, alphaVal, step
+
+    return geometry.MultiPoint(points).convex_hull, None, maxSteps
@@ -0,0 +1,254 @@
+## Incremental clustering
+##
+## Keeps everything needed to rebuild a map's output in a state directory, so a
+## new drop of .dat files only costs parsing those files and reclustering the
+## time buckets they add points to. Every (partition, time) bucket keeps its
+## point records (with their labels), core point flags, win rates and hulls. Clusters that
+## carry over between runs keep their label, matched on the core points the old
+## and new clustering share, so clusterNo in the front-end stays meaningful.
+##
+## New files are ingested after every file already in the state, so their rounds
+## are numbered on from the last run. Every time period asked for keeps its own
+## buckets, all made from the same parse. Changing clusterOptions, partitionBy,
+## the periods or the parser's tracePeriod, or changing or removing a file that
+## was already ingested, rebuilds from scratch.
+
+import itertools, json, os, shutil
+import numpy as np
+
+from . import metrics
+from .metrics import profileBucket
+from .parse import continueParsing, listDataFiles, newParseState, tracePeriod
+from .pipeline import biggestFirst, clusterWorkUnit, runUnits
+from .records import newTables, recordPoints, tablesFromJson, tablesToJson
+from .snapshots import partitionBy as defaultPartitionBy, partitionKeys, partitionSnapshots, pendingSnapshots, timePeriod
+
+stateVersion = 4
+
+
+def fileStamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def positionsToJson(positions):
+    #{player: [position, round, filename]} has int keys, which json would turn into strings
+    return [[player, entry] for player, entry in positions.items()]
+
+
+def positionsFromJson(pairs):
+    return {player: entry for player, entry in pairs}
+
+
+def newState(clusterOptions, partitionBy, periods):
+    endState = newParseState()
+    endState['mostRecentPositions'] = []
+    return {'version': stateVersion, 'clusterOptions': clusterOptions, 'partitionBy': list(partitionBy),
+            'periods': list(periods), 'tracePeriod': tracePeriod, 'files': {}, 'endState': endState, 'pending': [],
+            'playerTeams': [], 'playerDeaths': [], 'listOfWinningTeams': [], 'tables': tablesToJson(newTables()), 'buckets': []}
+
+
+def loadState(stateDirectory, directory, clusterOptions, partitionBy, periods):
+    #the saved state, or a new one if there isn't one that can be carried on from
+    try:
+        with open(os.path.join(stateDirectory, 'state.json'), 'r') as fp:
+            state = json.load(fp)
+    except (OSError, ValueError):
+        return newState(clusterOptions, partitionBy, periods)
+
+    if state.get('version') != stateVersion:
+        reason = "it was written by a different version"
+    elif state['clusterOptions'] != clusterOptions or state['partitionBy'] != list(partitionBy):
+        reason = "clusterOptions or partitionBy changed"
+    elif state['periods'] != list(periods) or state['tracePeriod'] != tracePeriod:
+        reason = "the time periods or tracePeriod changed"
+    else:
+        reason = None
+        for filename, stamp in state['files'].items():
+            path = os.path.join(directory, filename)
+            if not os.path.exists(path) or fileStamp(path) != stamp:
+                reason = filename + " changed or was removed"
+                break
+
+    if reason is not None:
+        print("Rebuilding clustering state, " + reason)
+        return newState(clusterOptions, partitionBy, periods)
+    return state
+
+
+def bucketPath(stateDirectory, name, extension):
+    return os.path.join(stateDirectory, 'buckets', name + extension)
+
+
+def readBucket(stateDirectory, name):
+    with np.load(bucketPath(stateDirectory, name, '.npz')) as arrays:
+        bucket = {key: arrays[key] for key in ('records', 'core')}
+    with open(bucketPath(stateDirectory, name, '.json'), 'r') as fp:
+        bucket.update(json.load(fp))
+    return bucket
+
+
+def writeBucket(stateDirectory, name, bucket):
+    np.savez(bucketPath(stateDirectory, name, '.npz'), records=bucket['records'], core=bucket['core'])
+    with open(bucketPath(stateDirectory, name, '.json'), 'w') as fp:
+        json.dump({key: bucket[key] for key in ('winRates', 'shapes')}, fp)
+
+
+def writeState(stateDirectory, state):
+    #swapped in whole once every bucket is written
+    temporary = os.path.join(stateDirectory, 'state.json.tmp')
+    with open(temporary, 'w') as fp:
+        json.dump(state, fp)
+    os.replace(temporary, os.path.join(stateDirectory, 'state.json'))
+
+
+def stableLabels(labels, core, previousLabels, previousCore):
+    #renumber labels so every cluster sharing core points with a cluster of the previous run takes its label
+    #the first len(previousLabels) points are the previous run's points in the same order
+    #each previous label goes to the cluster it shares the most core points with, clusters left over get the lowest free labels
+    labels = np.asarray(labels)
+    previousCount = len(previousLabels)
+    oldLabels = labels[:previousCount]
+
+    shared = core[:previousCount] & previousCore & (oldLabels >= 0) & (previousLabels >= 0)
+    pairs, overlap = np.unique(np.stack([oldLabels[shared], previousLabels[shared]], axis=1), axis=0, return_counts=True)
+
+    mapping = {-1: -1}
+    used = set()
+    for index in np.argsort(-overlap, kind='stable').tolist():
+        label, previousLabel = pairs[index].tolist()
+        if label not in mapping and previousLabel not in used:
+            mapping[label] = previousLabel
+            used.add(previousLabel)
+
+    freeLabels = (label for label in itertools.count() if label not in used)
+    for label in np.unique(labels).tolist():
+        if label not in mapping:
+            mapping[label] = next(freeLabels)
+
+    uniqueLabels, inverse = np.unique(labels, return_inverse=True)
+    return np.array([mapping[label] for label in uniqueLabels.tolist()], dtype=np.int64)[inverse]
+
+
+def runBucketUpdate(unit):
+    key, points, wins, previousLabels, previousCore, clusterOptions, profileDirectory = unit
+    period, partition, time = key
+    with profileBucket(profileDirectory, partition, time, period):
+        labels, core, winRates, shapes, bucketMetrics = clusterWorkUnit(points, wins, time, clusterOptions,
+                                                                        lambda labels, core: stableLabels(labels, core, previousLabels, previousCore))
+    return key, labels, core, winRates, shapes, bucketMetrics
+
+
+def updateState(directory, stateDirectory, workers=None, cacheDirectory=None, clusterOptions=None, partitionBy=defaultPartitionBy,
+                periods=(timePeriod,)):
+    #bring the state in stateDirectory up to date with the .dat files in directory, with buckets of every period in periods
+    clusterOptions = clusterOptions or {}
+    state = loadState(stateDirectory, directory, clusterOptions, partitionBy, periods)
+    if not state['files'] and os.path.isdir(os.path.join(stateDirectory, 'buckets')):
+        shutil.rmtree(os.path.join(stateDirectory, 'buckets'))
+    os.makedirs(os.path.join(stateDirectory, 'buckets'), exist_ok=True)
+
+    newPaths = [path for path in listDataFiles(directory) if os.path.basename(path) not in state['files']]
+    print("New files to ingest: " + str(len(newPaths)))
+
+    tables = tablesFromJson(state['tables'])
+    buckets = [(entry['period'], tuple(entry['partition']), entry['time'], entry['name']) for entry in state['buckets']]
+    bucketNames = {(period, partition, time): name for period, partition, time, name in buckets}
+    units = []
+
+    if newPaths:
+        endState = dict(state['endState'])
+        endState['mostRecentPositions'] = positionsFromJson(endState['mostRecentPositions'])
+        with metrics.stage('parse'):
+            output, newTeams, newDeaths, newWinners, endState = continueParsing(newPaths, endState, workers, cacheDirectory)
+
+        #merged as if the new files followed on from the old ones in a single parse
+        playerTeams = {(r, player): team for r, player, team in state['playerTeams']}
+        playerTeams.update(newTeams)
+        playerDeaths = {(r, player): (tick, relativeTick) for r, player, tick, relativeTick in state['playerDeaths']}
+        for key, death in newDeaths.items():
+            playerDeaths.setdefault(key, death)
+        listOfWinningTeams = {r: winner for r, winner in state['listOfWinningTeams']}
+        for r, winner in newWinners.items():
+            if r in listOfWinningTeams:
+                raise Exception("Round can't end twice.")
+            listOfWinningTeams[r] = winner
+
+        output = [[tick, positionsFromJson(positions), r] for tick, positions, r in state['pending']] + output
+        with metrics.stage('snapshotJoin'):
+            periodRecords = {}
+            for period in periods:
+                periodRecords[period], tables = partitionSnapshots(output, playerTeams, playerDeaths, listOfWinningTeams,
+                                                                   partitionBy, tables, period)
+
+        #every bucket that gained points is reclustered with its old points first, so old labels can be matched up
+        for period, dictRecords in periodRecords.items():
+            for partition, times in dictRecords.items():
+                for time, records in times.items():
+                    key = (period, partition, time)
+                    if key in bucketNames:
+                        previous = readBucket(stateDirectory, bucketNames[key])
+                        previousLabels, previousCore = previous['records']['cluster'].astype(np.int64), previous['core']
+                        records = np.concatenate([previous['records'], records])
+                    else:
+                        bucketNames[key] = 'bucket' + str(len(buckets))
+                        buckets.append((period, partition, time, bucketNames[key]))
+                        previousLabels, previousCore = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+                    units.append(((key, recordPoints(records), records['win'].copy(), previousLabels, previousCore,
+                                   clusterOptions, metrics.profileDirectory()), records))
+
+        state['files'].update((os.path.basename(path), fileStamp(path)) for path in newPaths)
+        state['endState'] = dict(endState, mostRecentPositions=positionsToJson(endState['mostRecentPositions']))
+        state['pending'] = [[tick, positionsToJson(positions), r] for tick, positions, r in pendingSnapshots(output, endState)]
+        #only rounds from the one still running on can gain snapshots, or end, in a later drop, as in joinSnapshots
+        roundCount = endState['roundCount']
+        state['playerTeams'] = [[r, player, team] for (r, player), team in playerTeams.items() if r >= roundCount]
+        state['playerDeaths'] = [[r, player, tick, relativeTick] for (r, player), (tick, relativeTick) in playerDeaths.items() if r >= roundCount]
+        state['listOfWinningTeams'] = [[r, winner] for r, winner in listOfWinningTeams.items() if r >= roundCount]
+        state['tables'] = tablesToJson(tables)
+        state['buckets'] = [{'period': period, 'partition': list(partition), 'time': time, 'name': name}
+                            for period, partition, time, name in buckets]
+
+    units = biggestFirst(units, lambda unit: unit[0][1])
+    recordsByKey = {unit[0]: records for unit, records in units}
+
+    #buckets are rewritten in place, so until the new state is written an interrupted run has to start again
+    if units and os.path.exists(os.path.join(stateDirectory, 'state.json')):
+        os.remove(os.path.join(stateDirectory, 'state.json'))
+
+    with metrics.stage('cluster'):
+        for key, labels, core, winRates, shapes, bucketMetrics in runUnits(runBucketUpdate, [unit for unit, records in units], workers):
+            metrics.recordBucket(key[1], key[2], bucketMetrics, key[0])
+            records = recordsByKey.pop(key)
+            records['cluster'] = labels
+            writeBucket(stateDirectory, bucketNames[key], {'records': records, 'core': core, 'winRates': winRates, 'shapes': shapes})
+
+    writeState(stateDirectory, state)
+    print("Reclustered " + str(len(units)) + " of " + str(len(buckets)) + " time buckets")
+    return tables
+
+
+def savedBuckets(stateDirectory, partitionBy=defaultPartitionBy, period=timePeriod):
+    #(partition, time, winRates, records, shapes) of every bucket of period in the state, one bucket read at a time
+    #in partition order, then the order times were first seen
+    with open(os.path.join(stateDirectory, 'state.json'), 'r') as fp:
+        buckets = [entry for entry in json.load(fp)['buckets'] if entry['period'] == period]
+
+    order = {partition: i for i, partition in enumerate(partitionKeys(partitionBy))}
+    for entry in sorted(buckets, key=lambda entry: order[tuple(entry['partition'])]):
+        bucket = readBucket(stateDirectory, entry['name'])
+        yield tuple(entry['partition']), entry['time'], bucket['winRates'], bucket['records'], bucket['shapes']
+
+
+def savedRecords(stateDirectory, partitionBy=defaultPartitionBy, period=timePeriod):
+    #the point records of every bucket of period in the state as dictRecords, {partition: {time: records}} like joinSnapshots gives
+    dictRecords = {partition: {} for partition in partitionKeys(partitionBy)}
+    for partition, time, winRates, records, shapes in savedBuckets(stateDirectory, partitionBy, period):
+        dictRecords[partition][time] = records
+    return dictRecords
+
+
+def savedTables(stateDirectory):
+    #the tables the state's records were interned in, to write them out with
+    with open(os.path.join(stateDirectory, 'state.json'), 'r') as fp:
+        return tablesFromJson(json.load(fp)['tables'])
@@ -0,0 +1,151 @@
+## Cluster lookup
+##
+## Answers "which cluster is this position in, and what's its win rate" for
+## positions from other demos, straight from a finished run's output: either the
+## clusterShapes.json and clusterWinRates.json files or a sharded output's
+## directory (see output.py), whose buckets are only read when first asked for.
+##
+## Every bucket gets an STRtree over its prepared hull polygons when it's first
+## used. lookupClusters takes NumPy arrays of positions, groups them by bucket,
+## asks the tree which hulls the group's bounding box touches, and tests the
+## group's points against each of those hulls at once with intersects_xy, so no
+## shapely object is made per position. A position inside more than one hull
+## (concave hulls can overlap a little) gets the lowest numbered cluster.
+##
+##   index = loadIndex('.')
+##   clusters, winRates = lookupClusters(index, ('win', 2), seconds, x, y)
+##
+## seconds is the time since the round's freeze time ended, the time bucket of
+## seconds s is the one holding positions of ((k - 1) * period, k * period] with k = ceil(s / period).
+
+import json, os
+import numpy as np
+
+import shapely
+from shapely.strtree import STRtree
+
+from .output import readShard
+from .parse import windowTime
+from .snapshots import partitionBy as defaultPartitionBy, timePeriod as defaultTimePeriod
+
+
+def loadIndex(directory='.', suffix='', partitionBy=defaultPartitionBy, period=defaultTimePeriod):
+    #an index over the output in directory, sharded if it has a manifest.json, else clusterShapes<suffix>.json and
+    #clusterWinRates<suffix>.json, whose partitionBy and period have to be given as they aren't written in the files
+    index = {'directory': directory, 'manifest': None, 'shapes': None, 'winRates': None, 'buckets': {}}
+
+    manifestPath = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifestPath):
+        with open(manifestPath, 'r') as fp:
+            index['manifest'] = json.load(fp)
+        index['partitionBy'] = index['manifest']['partitionBy']
+        index['period'] = index['manifest']['timePeriod']
+        return index
+
+    with open(os.path.join(directory, 'clusterShapes' + suffix + '.json'), 'r') as fp:
+        index['shapes'] = json.load(fp)
+    with open(os.path.join(directory, 'clusterWinRates' + suffix + '.json'), 'r') as fp:
+        index['winRates'] = json.load(fp)
+    index['partitionBy'] = list(partitionBy)
+    index['period'] = period
+    return index
+
+
+def readBucket(index, partition, time):
+    #(shapes, winRates) of one bucket, None if there isn't one
+    if index['manifest'] is not None:
+        times = index['manifest']['times']
+        for value in partition:
+            times = times.get(value, {})
+        if time not in times:
+            return None
+        return (readShard(index['directory'], index['manifest'], partition, time, 'shapes'),
+                readShard(index['directory'], index['manifest'], partition, time, 'winRates'))
+
+    shapes = index['shapes']
+    winRates = index['winRates']
+    for value in partition:
+        shapes = shapes.get(value, {})
+        winRates = winRates.get(value, {})
+    if str(time) not in shapes:
+        return None
+    return shapes[str(time)], winRates[str(time)]
+
+
+def bucketIndex(index, partition, time):
+    #the STRtree and prepared hulls of one bucket, built the first time it's asked for, None if there's no such bucket
+    key = tuple(partition) + (time,)
+    if key not in index['buckets']:
+        bucket = readBucket(index, partition, time)
+        if bucket is None:
+            index['buckets'][key] = None
+        else:
+            shapes, winRates = bucket
+            clusters = sorted(shapes, key=int)
+            polygons = np.array([shapely.polygons(shapes[cluster]) for cluster in clusters], dtype=object)
+            shapely.prepare(polygons)
+            index['buckets'][key] = {'clusters': np.array([int(cluster) for cluster in clusters], dtype=np.int64),
+                                     'polygons': polygons, 'bounds': shapely.bounds(polygons), 'tree': STRtree(polygons),
+                                     'winRates': np.array([winRates.get(cluster, np.nan) for cluster in clusters], dtype=np.float64)}
+    return index['buckets'][key]
+
+
+def bucketLookup(bucket, x, y):
+    #index into the bucket's clusters of every point, -1 outside them all
+    found = np.full(len(x), -1, dtype=np.int64)
+    batch = shapely.box(x.min(), y.min(), x.max(), y.max())
+    for i in np.sort(bucket['tree'].query(batch)).tolist():
+        minX, minY, maxX, maxY = bucket['bounds'][i]
+        candidates = np.flatnonzero((x >= minX) & (x <= maxX) & (y >= minY) & (y <= maxY) & (found == -1))
+        inside = candidates[shapely.intersects_xy(bucket['polygons'][i], x[candidates], y[candidates])]
+        found[inside] = i
+    return found
+
+
+def lookupClusters(index, partition, seconds, x, y):
+    #cluster and win rate of every position, -1 and nan for positions outside every cluster or with no bucket
+    #partition has a value per partitionBy field, e.g. ('win', 2), each one value or an array of one per position
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    count = len(x)
+    windows = np.ceil(np.broadcast_to(np.asarray(seconds, dtype=np.float64), (count,)) / index['period']).astype(np.int64)
+
+    #one group of positions per bucket, from a single key combining the partition's values and the window
+    keys = np.zeros(count, dtype=np.int64)
+    fieldValues = []
+    for value in partition:
+        value = np.asarray(value)
+        if value.ndim == 0:
+            fieldValues.append([str(value)])
+            continue
+        values, inverse = np.unique(value.astype(str).ravel(), return_inverse=True)
+        keys = keys * len(values) + inverse
+        fieldValues.append(values.tolist())
+    windowValues, inverse = np.unique(windows, return_inverse=True)
+    keys = keys * len(windowValues) + inverse
+
+    groups, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(groups)))])
+
+    clusters = np.full(count, -1, dtype=np.int64)
+    winRates = np.full(count, np.nan)
+    for i, key in enumerate(groups.tolist()):
+        key, window = divmod(key, len(windowValues))
+        window = windowValues[window]
+        groupPartition = []
+        for values in reversed(fieldValues):
+            key, value = divmod(key, len(values))
+            groupPartition.insert(0, values[value])
+
+        bucket = bucketIndex(index, groupPartition, windowTime(window, index['period'])) if window >= 1 else None
+        if bucket is None or not len(bucket['clusters']):
+            continue
+
+        members = order[bounds[i]:bounds[i + 1]]
+        found = bucketLookup(bucket, x[members], y[members])
+        hit = found != -1
+        clusters[members[hit]] = bucket['clusters'][found[hit]]
+        winRates[members[hit]] = bucket['winRates'][found[hit]]
+
+    return clusters, winRates
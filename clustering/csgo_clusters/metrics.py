@@ -0,0 +1,135 @@
+## Run metrics
+##
+## Timers and counters for a clustering run: seconds and peak memory of every
+## stage, and for every (partition, time) bucket its points, clusters, noise,
+## the seconds spent clustering, on win rates and on hulls, and how many alpha
+## steps each hull took. Buckets are clustered in worker processes, so their
+## numbers travel back with the work unit's results and are recorded here.
+##
+## With a metrics directory every finished stage and bucket is appended to
+## events.jsonl as it happens and metrics.json is written at the end. Stages
+## named in profileStages are run under cProfile and dumped to
+## profiles/<stage>.prof, and 'buckets' profiles every bucket's work unit on its
+## own as profiles/bucket_<partition>_<time>.prof. A stage run more than once,
+## once for every time period, adds up, and so does its profile.
+
+import contextlib, cProfile, json, os, sys, time
+
+try:
+    import resource
+except ImportError: #Windows
+    resource = None
+
+run = {'directory': None, 'profileStages': frozenset(), 'started': None, 'stages': {}, 'profiles': {}, 'buckets': [], 'counters': {}}
+
+
+def peakRss():
+    #this process's peak resident memory in bytes, None where it can't be read
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak * 1024 if sys.platform != 'darwin' else peak #kilobytes on Linux, bytes on macOS
+
+
+def startRun(directory=None, profileStages=()):
+    #start recording a new run, into directory if given
+    run.update({'directory': directory, 'profileStages': frozenset(profileStages), 'started': time.perf_counter(),
+                'stages': {}, 'profiles': {}, 'buckets': [], 'counters': {}})
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        if run['profileStages']:
+            os.makedirs(os.path.join(directory, 'profiles'), exist_ok=True)
+        open(os.path.join(directory, 'events.jsonl'), 'w').close()
+
+
+def profileDirectory():
+    #where work units should write their own profiles, None unless 'buckets' is being profiled
+    if run['directory'] is None or 'buckets' not in run['profileStages']:
+        return None
+    return os.path.join(run['directory'], 'profiles')
+
+
+def logEvent(event):
+    if run['directory'] is not None:
+        with open(os.path.join(run['directory'], 'events.jsonl'), 'a') as fp:
+            fp.write(json.dumps(event) + '\n')
+
+
+def count(name, amount=1):
+    run['counters'][name] = run['counters'].get(name, 0) + amount
+
+
+@contextlib.contextmanager
+def stage(name):
+    #time a stage of the run, under cProfile if it's one of profileStages
+    profile = None
+    if run['directory'] is not None and name in run['profileStages']:
+        profile = run['profiles'].setdefault(name, cProfile.Profile())
+        profile.enable()
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(os.path.join(run['directory'], 'profiles', name + '.prof'))
+
+        previous = run['stages'].get(name, {'seconds': 0.0, 'runs': 0})
+        run['stages'][name] = {'seconds': previous['seconds'] + seconds, 'runs': previous['runs'] + 1, 'peakRssBytes': peakRss()}
+        logEvent({'event': 'stage', 'stage': name, 'seconds': seconds, 'peakRssBytes': peakRss()})
+
+
+@contextlib.contextmanager
+def profileBucket(directory, partition, time, period=None):
+    #profile one bucket's work unit into directory, which does nothing if directory is None
+    if directory is None:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        name = '_'.join(str(value) for value in tuple(partition) + (time,) + ((period,) if period is not None else ()))
+        profile.dump_stats(os.path.join(directory, 'bucket_' + name + '.prof'))
+
+
+def bucketMetrics(labels, seconds, hullStats):
+    #metrics of one clustered bucket, seconds holds the time of each step and hullStats what bucketHulls recorded
+    labels = list(labels)
+    return {'points': len(labels), 'clusters': len(set(labels) - {-1}), 'noise': labels.count(-1),
+            'seconds': seconds, 'alphaSteps': sum(hull['alphaSteps'] for hull in hullStats),
+            'convexFallbacks': sum(1 for hull in hullStats if hull['alpha'] is None),
+            'hulls': hullStats, 'workerPeakRssBytes': peakRss()}
+
+
+def recordBucket(partition, time, metrics, period=None):
+    bucket = dict(metrics, partition=list(partition), time=time, period=period)
+    run['buckets'].append(bucket)
+    count('buckets')
+    count('points', metrics['points'])
+    count('alphaSteps', metrics['alphaSteps'])
+    count('convexFallbacks', metrics['convexFallbacks'])
+    logEvent(dict(bucket, event='bucket'))
+
+
+def finishRun(slowest=10):
+    #write metrics.json and return the summary, the slowest buckets are listed on their own to find hot spots
+    def total(bucket):
+        return sum(bucket['seconds'].values())
+
+    summary = {'seconds': time.perf_counter() - run['started'] if run['started'] is not None else None,
+               'peakRssBytes': peakRss(), 'stages': run['stages'], 'counters': run['counters'],
+               'slowestBuckets': [{'partition': bucket['partition'], 'time': bucket['time'], 'period': bucket['period'], 'seconds': total(bucket),
+                                   'points': bucket['points'], 'alphaSteps': bucket['alphaSteps']}
+                                  for bucket in sorted(run['buckets'], key=total, reverse=True)[:slowest]],
+               'buckets': run['buckets']}
+
+    if run['directory'] is not None:
+        with open(os.path.join(run['directory'], 'metrics.json'), 'w') as fp:
+            json.dump(summary, fp, indent=1)
+    return summary
@@ -0,0 +1,91 @@
+## Sharded output
+##
+## Instead of three whole-map JSON files, every (partition, time) bucket's win
+## rates, shapes and positions are appended as separate shards to one pack file
+## per kind as soon as the bucket is finished. manifest.json, written last, holds
+## the labels, the times available for every partition and the offset and length
+## of every shard, so a viewer only has to read the bytes of the bucket it shows:
+##
+##   manifest['buckets']['win']['2']['3072']['shapes'] == [offset, length]
+##
+## Each shard is the JSON the bucket has in the whole-map file, optionally gzip
+## compressed on its own so it can be decompressed without the rest of the pack.
+## A sharded output holds one time period, which the manifest names.
+
+import gzip, json, os
+
+from .records import pointersJson
+from .snapshots import partitionBy as defaultPartitionBy, partitionValues, timePeriod as defaultTimePeriod
+
+manifestVersion = 1
+shardKinds = {'winRates': 'clusterWinRates', 'shapes': 'clusterShapes', 'positions': 'clusterPositions'}
+compressions = (None, 'gzip')
+
+
+def openShards(outputDirectory, compression=None, partitionBy=defaultPartitionBy, timePeriod=defaultTimePeriod):
+    #start a sharded output in outputDirectory, shards are added with writeShards and closeShards writes the manifest
+    if compression not in compressions:
+        raise ValueError("unknown compression: " + str(compression))
+    os.makedirs(outputDirectory, exist_ok=True)
+
+    extension = '.shards' + ('.gz' if compression == 'gzip' else '')
+    files = {kind: name + extension for kind, name in shardKinds.items()}
+    return {'directory': outputDirectory, 'compression': compression, 'partitionBy': list(partitionBy), 'timePeriod': timePeriod, 'files': files,
+            'packs': {kind: open(os.path.join(outputDirectory, files[kind]), 'wb') for kind in files},
+            'buckets': {}}
+
+
+def writeShards(shards, partition, time, winRates, shapes, records, tables):
+    #append one bucket's shards and note where they went, tables are the ones the records were interned in
+    entry = {}
+    for kind, text in (('winRates', json.dumps(winRates)), ('shapes', json.dumps(shapes)), ('positions', pointersJson(records, tables))):
+        data = text.encode('utf8')
+        if shards['compression'] == 'gzip':
+            data = gzip.compress(data, mtime=0)
+
+        pack = shards['packs'][kind]
+        entry[kind] = [pack.tell(), len(data)]
+        pack.write(data)
+
+    buckets = shards['buckets']
+    for value in partition:
+        buckets = buckets.setdefault(str(value), {})
+    buckets[str(time)] = entry
+
+
+def closeShards(shards):
+    #close the pack files and write the manifest, returns the manifest
+    for pack in shards['packs'].values():
+        pack.close()
+
+    def sortedTimes(buckets, depth):
+        if depth == 0:
+            return sorted(int(time) for time in buckets)
+        return {value: sortedTimes(nested, depth - 1) for value, nested in buckets.items()}
+
+    partitionBy = shards['partitionBy']
+    manifest = {'version': manifestVersion, 'partitionBy': partitionBy, 'timePeriod': shards['timePeriod'],
+                'labels': [[str(value) for value in partitionValues[field]] for field in partitionBy],
+                'compression': shards['compression'], 'files': shards['files'],
+                'times': sortedTimes(shards['buckets'], len(partitionBy)), 'buckets': shards['buckets']}
+
+    temporary = os.path.join(shards['directory'], 'manifest.json.tmp')
+    with open(temporary, 'w') as fp:
+        json.dump(manifest, fp)
+    os.replace(temporary, os.path.join(shards['directory'], 'manifest.json'))
+    return manifest
+
+
+def readShard(outputDirectory, manifest, partition, time, kind):
+    #one bucket's winRates, shapes or positions back from a sharded output
+    entry = manifest['buckets']
+    for value in partition:
+        entry = entry[str(value)]
+    offset, length = entry[str(time)][kind]
+
+    with open(os.path.join(outputDirectory, manifest['files'][kind]), 'rb') as fp:
+        fp.seek(offset)
+        data = fp.read(length)
+    if manifest['compression'] == 'gzip':
+        data = gzip.decompress(data)
+    return json.loads(data.decode('utf8'))
@@ -0,0 +1,343 @@
+## CS:GO .dat parsing
+##
+## Parses the tab-separated event files written by importToFile.js into round
+## snapshots. Every file is parsed on its own with a fresh state machine so files
+## can be spread over a process pool, then the results are merged back in
+## directory order, renumbering rounds as the serial loop would have.
+##
+## streamRounds hands the results on as they come instead of merging them, a
+## round at a time for files parsed in this process (every round_end and every
+## round_start, begin_new_match, cs_pre_restart or round_prestart that abandons
+## a round closes a result) and a file at a time for files from the cache or a
+## worker. Every result has the same fields as a whole file's, with the endState
+## at the point it was closed.
+##
+## Positions are recorded once, in windows of tracePeriod seconds: every window
+## holds each player's last footstep in it, and every window a round gets past
+## is output, empty or not, so coarser time periods can be put together from
+## them afterwards (see downsample in snapshots.py). A snapshot is
+## [time, positions, round], its time the end of its window in ticks at
+## timeTickRate. The tick rate of a file is read from its demo_header row, files
+## written before importToFile.js wrote one are taken to be defaultTickRate.
+##
+## Round metadata is kept in keyed indexes rather than lists to search:
+##   playerTeams         (round, player) -> team the player last spawned on
+##   playerDeaths        (round, player) -> (tick, relativeTick) of the player's first death, relativeTick at timeTickRate
+##   listOfWinningTeams  round -> winning team
+
+import collections, json, os
+from functools import partial
+from multiprocessing import Pool
+
+from .cache import readCachedFile, sourceStamp, writeCachedFile
+
+tracePeriod = 1 #seconds per recorded window, every time period clustered has to be a multiple of it
+defaultTickRate = 128 #ticks per second of files without a demo_header row
+timeTickRate = 128 #times are written as ticks at this rate whatever the demo's, which is what the front-end expects
+freezeTime = 15 #seconds of freeze time at the start of every round
+
+#the only events the state machine reacts to, every other row just moves the clock on
+handledEvents = frozenset(['demo_header', 'round_start', 'player_spawn', 'player_death', 'round_end',
+                           'begin_new_match', 'cs_pre_restart', 'round_prestart', 'player_footstep'])
+
+
+def getJsonObject(string):
+    return json.loads(string)
+
+
+def newParseState(roundCount=0):
+    return {'roundCount': roundCount, 'mostRecentStart': -1, 'nextWindow': 1, 'mostRecentPositions': {}, 'tickRate': defaultTickRate}
+
+
+def windowTime(window, period=None):
+    #time of the end of a round's window-th window of period seconds, tracePeriod if not given
+    return int(round(window * (period or tracePeriod) * timeTickRate))
+
+
+def parseRounds(path, state=None):
+    #parse one .dat file, starting from state (a fresh state unless a previous file stopped mid-round)
+    #yields a result for every stretch of the file up to a round ending or being abandoned, and one for the rest of the file
+    if state is None:
+        state = newParseState()
+
+    filename = os.path.basename(path)
+    roundBase = state['roundCount']
+    roundCount = roundBase
+    mostRecentStart = state['mostRecentStart']
+    nextWindow = state['nextWindow']
+    mostRecentPositions = dict(state['mostRecentPositions'])
+    #a file has its own tick rate, the previous file's only carries over into the round it stopped in
+    tickRate = state['tickRate'] if mostRecentStart != -1 else defaultTickRate
+    nextTickToPoll = nextWindow * tracePeriod * tickRate
+
+    output = []
+    playerTeams = {}
+    playerDeaths = {}
+    listOfWinningTeams = {}
+    endedRounds = set()
+
+    def result():
+        return {'filename': filename, 'roundBase': roundBase, 'output': output,
+                'playerTeams': playerTeams, 'playerDeaths': playerDeaths, 'listOfWinningTeams': listOfWinningTeams,
+                'endState': {'roundCount': roundCount, 'mostRecentStart': mostRecentStart, 'nextWindow': nextWindow,
+                             'mostRecentPositions': dict(mostRecentPositions), 'tickRate': tickRate}}
+
+    with open(path, 'r', encoding="utf8") as f:
+        for line in f:
+            #only split off the tick and event name, the JSON columns are left alone unless the event is handled
+            row = line.rstrip('\r\n').split('\t', 2)
+            tick = int(row[0])
+
+            #close every window the clock has passed, even empty ones, so coarser periods know how far the round got
+            while ((mostRecentStart != -1) and (tick - mostRecentStart > nextTickToPoll)):
+
+                #add most recent steps to output
+                output.append([windowTime(nextWindow), mostRecentPositions, roundCount])
+
+                #reset mostRecentPositions
+                mostRecentPositions = {}
+
+                nextWindow += 1
+                nextTickToPoll = nextWindow * tracePeriod * tickRate
+
+            event = row[1]
+            if event not in handledEvents:
+                continue
+
+            if (event == 'demo_header'):
+
+                tickRate = getJsonObject(row[2].split('\t', 1)[0])['tickRate']
+                nextTickToPoll = nextWindow * tracePeriod * tickRate
+
+            elif (event == 'round_start'):
+
+                #increment round count
+                roundCount += 1
+
+                #reset most recent start
+                mostRecentStart = tick + (freezeTime * tickRate) #account for 15 second freeze time
+
+                #reset next tick to poll
+                nextWindow = 1
+                nextTickToPoll = tracePeriod * tickRate
+
+                #the round before this one is over, ended or not
+                yield result()
+                output, playerTeams, playerDeaths, listOfWinningTeams = [], {}, {}, {}
+
+            elif (event == 'player_spawn'):
+
+                if (mostRecentStart == -1):
+                    #if we are between rounds the spawns will be for the next round that is yet to start
+                    roundOfSpawn = roundCount + 1
+                else:
+                    roundOfSpawn = roundCount
+
+                row = [row[0], row[1]] + row[2].split('\t')
+
+                #data sometimes has phantom spawns with incomplete data since this is before the round actually starts
+                try:
+                    playerNumber = getJsonObject(row[4])['player']
+
+                    #set playerTeam for this round, a later spawn in the same round replaces it
+                    team = getJsonObject(row[2])['teamnum']
+                    playerTeams[(roundOfSpawn, playerNumber)] = team
+                except TypeError:
+                    pass
+
+            elif (mostRecentStart > -1):
+
+                if (event == 'player_death'):
+
+                    try:
+                        row = [row[0], row[1]] + row[2].split('\t')
+
+                        #set player death for round number, only the first death counts
+                        playerNumber = getJsonObject(row[4])['player']
+
+                        #the tick is the demo's own, the time since the round started is in ticks at timeTickRate like snapshot times
+                        playerDeaths.setdefault((roundCount, playerNumber), (tick, int(round((tick - mostRecentStart) * timeTickRate / tickRate))))
+
+                    except Exception:
+                        pass
+
+                elif (event == 'round_end'):
+
+                    #make mostRecentStart invalid so we check we're not doing something stupid
+                    mostRecentStart = -1
+
+                    #add the winning team to the listOfWinners in position of roundCount
+                    winner = getJsonObject(row[2].split('\t', 1)[0])['winner']
+
+                    if roundCount not in endedRounds:
+                        listOfWinningTeams[roundCount] = (winner)
+                        endedRounds.add(roundCount)
+                    else:
+                        raise Exception("Round can't end twice.")
+
+                    #reset mostRecentPositions
+                    mostRecentPositions = {}
+
+                    yield result()
+                    output, playerTeams, playerDeaths, listOfWinningTeams = [], {}, {}, {}
+
+                elif (event == 'begin_new_match' or event == 'cs_pre_restart' or event == 'round_prestart'): ##These handle round restarts where a round does not formally 'end'
+
+                    #make mostRecentStart invalid so we check we're not doing something stupid
+                    mostRecentStart = -1
+
+                    #reset mostRecentPositions
+                    mostRecentPositions = {}
+
+                    yield result()
+                    output, playerTeams, playerDeaths, listOfWinningTeams = [], {}, {}, {}
+
+                elif (event == 'player_footstep'):
+                    try:
+                        row = [row[0], row[1]] + row[2].split('\t')
+
+                        playerNumber = getJsonObject(row[4])['player']
+
+                        mostRecentPositions[playerNumber] = [getJsonObject(row[3])['player'], roundCount, filename]
+
+                    except TypeError:
+                        pass
+
+    yield result()
+
+
+def mergeResult(merged, result):
+    #add a later result onto merged, as if they had been parsed as one
+    merged['output'].extend(result['output'])
+    #later results win for teams and earlier ones for deaths
+    merged['playerTeams'].update(result['playerTeams'])
+    for key, death in result['playerDeaths'].items():
+        merged['playerDeaths'].setdefault(key, death)
+    for r, winner in result['listOfWinningTeams'].items():
+        if r in merged['listOfWinningTeams']:
+            raise Exception("Round can't end twice.")
+        merged['listOfWinningTeams'][r] = winner
+    merged['endState'] = result['endState']
+
+
+def parseFile(path, state=None):
+    #every result of parseRounds merged into one for the whole file
+    merged = None
+    for result in parseRounds(path, state):
+        if merged is None:
+            merged = result
+        else:
+            mergeResult(merged, result)
+    return merged
+
+
+def parseFileCached(path, cacheDirectory=None):
+    #parseFile, but reusing the columnar cache when the file hasn't changed since it was last parsed
+    if cacheDirectory is None:
+        return parseFile(path)
+
+    result = readCachedFile(cacheDirectory, path, tracePeriod)
+    if result is None:
+        stamp = sourceStamp(path, tracePeriod)
+        result = parseFile(path)
+        writeCachedFile(cacheDirectory, path, result, stamp)
+    return result
+
+
+def offsetRounds(result, offset):
+    #renumber a file's rounds so they follow on from every file merged before it
+    if offset == 0:
+        return result
+
+    def shiftPositions(positions):
+        return {player: [entry[0], entry[1] + offset] + entry[2:] for player, entry in positions.items()}
+
+    endState = dict(result['endState'])
+    endState['roundCount'] += offset
+    endState['mostRecentPositions'] = shiftPositions(endState['mostRecentPositions'])
+
+    return {'filename': result['filename'], 'roundBase': result['roundBase'] + offset,
+            'output': [[tick, shiftPositions(positions), r + offset] for tick, positions, r in result['output']],
+            'playerTeams': {(r + offset, player): team for (r, player), team in result['playerTeams'].items()},
+            'playerDeaths': {(r + offset, player): death for (r, player), death in result['playerDeaths'].items()},
+            'listOfWinningTeams': {r + offset: winner for r, winner in result['listOfWinningTeams'].items()},
+            'endState': endState}
+
+
+def listDataFiles(directory):
+    #same order the serial loop used, so merged round numbers don't change
+    return [os.path.join(directory, filename) for filename in os.listdir(directory) if filename.endswith(".dat")]
+
+
+def boundedMap(pool, function, items, window):
+    #pool.imap, but with at most window items handed to the pool ahead of the one being consumed,
+    #so results don't pile up in memory while the consumer catches up
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def parseFiles(paths, workers=None, cacheDirectory=None):
+    #parse every file, across a pool of workers unless workers is 1, and merge them in order
+    #files already in cacheDirectory (if given) are loaded from there instead of being parsed
+    #returns output, playerTeams, playerDeaths, listOfWinningTeams and the number of rounds parsed
+    output, playerTeams, playerDeaths, listOfWinningTeams, endState = continueParsing(paths, newParseState(), workers, cacheDirectory)
+    return output, playerTeams, playerDeaths, listOfWinningTeams, endState['roundCount']
+
+
+def continueParsing(paths, state, workers=None, cacheDirectory=None):
+    #parseFiles, carrying on from the endState of files parsed before (so rounds keep counting up from there)
+    #returns output, playerTeams, playerDeaths, listOfWinningTeams and the endState after the last file
+    merged = {'output': [], 'playerTeams': {}, 'playerDeaths': {}, 'listOfWinningTeams': {}, 'endState': state}
+    for result in streamRounds(paths, state, workers, cacheDirectory):
+        mergeResult(merged, result)
+    return merged['output'], merged['playerTeams'], merged['playerDeaths'], merged['listOfWinningTeams'], merged['endState']
+
+
+def streamRounds(paths, state, workers=None, cacheDirectory=None):
+    #the results of every file in order, rounds numbered on from state, for a consumer to merge or join as they come
+    #files parsed in this process come a round at a time, files from the cache or a pool worker a file at a time
+    roundCount = state['roundCount']
+    carriedState = state
+
+    if cacheDirectory is not None:
+        os.makedirs(cacheDirectory, exist_ok=True)
+    parser = partial(parseFileCached, cacheDirectory=cacheDirectory)
+
+    pool = None
+    if workers != 1 and len(paths) > 1:
+        pool = Pool(workers)
+        results = boundedMap(pool, parser, paths, 2 * (workers or os.cpu_count() or 1))
+    else:
+        #parsed when they're needed below, so uncached files can be parsed a round at a time
+        results = (None for path in paths)
+
+    try:
+        for fileCount, (path, result) in enumerate(zip(paths, results), 1):
+            print("Parsing file " + str(fileCount) + ": " + os.path.basename(path))
+
+            if carriedState['mostRecentStart'] != -1 or (result is None and cacheDirectory is None):
+                #previous file stopped mid-round so its state leaks into this one, replay it from that state
+                #(a file after one that didn't stop mid-round parses the same from the carried state as from a fresh one)
+                for result in parseRounds(path, carriedState):
+                    yield result
+            else:
+                if result is None:
+                    result = parser(path)
+                result = offsetRounds(result, roundCount - result['roundBase'])
+                yield result
+
+            carriedState = result['endState']
+            roundCount = carriedState['roundCount']
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def streamDirectory(directory, workers=None, cacheDirectory=None):
+    return streamRounds(listDataFiles(directory), newParseState(), workers, cacheDirectory)
@@ -0,0 +1,134 @@
+## Clustering pipeline
+##
+## Clustering, win rates and hulls are run for every (partition, time bucket)
+## as an independent work unit across a process pool, then merged back into the
+## nested dicts the JSON files are written from, e.g. dictClusterShapes['win'][2][time].
+## Workers are only sent the x, y and win columns of a bucket's point records.
+
+from multiprocessing import Pool
+import time as timer
+
+from . import metrics
+from .clusters import bucketHulls, bucketWinRates, clusterBucket
+from .records import recordPoints
+
+
+def clusterWorkUnit(points, wins, time, clusterOptions, relabel=None):
+    #labels, core point flags, win rates, hulls and metrics of one bucket
+    #relabel(labels, core) can renumber the labels before they're used
+    seconds = {}
+    hullStats = []
+
+    start = timer.perf_counter()
+    labels, core = clusterBucket(points, **clusterOptions)
+    if relabel is not None:
+        labels = relabel(labels, core)
+    seconds['cluster'] = timer.perf_counter() - start
+
+    start = timer.perf_counter()
+    winRates = bucketWinRates(labels, wins, time)
+    seconds['winRates'] = timer.perf_counter() - start
+
+    start = timer.perf_counter()
+    shapes = bucketHulls(points, labels, time, hullStats)
+    seconds['hulls'] = timer.perf_counter() - start
+
+    return labels, core, winRates, shapes, metrics.bucketMetrics(labels.tolist(), seconds, hullStats)
+
+
+def runWorkUnit(unit):
+    partition, time, points, wins, clusterOptions, profileDirectory, period = unit
+    with metrics.profileBucket(profileDirectory, partition, time, period):
+        labels, core, winRates, shapes, bucketMetrics = clusterWorkUnit(points, wins, time, clusterOptions)
+    return partition, time, labels, winRates, shapes, bucketMetrics
+
+
+def runUnits(function, units, workers=None, ordered=False):
+    #results of function for every unit, across a pool of workers unless workers is 1
+    #results come in the order they finish, or in the order of units if ordered
+    if workers != 1 and len(units) > 1:
+        with Pool(workers) as pool:
+            yield from (pool.imap if ordered else pool.imap_unordered)(function, units)
+    else:
+        yield from map(function, units)
+
+
+def biggestFirst(units, points):
+    #units sorted by the number of points(unit), biggest first, so a large bucket picked up last doesn't leave the other workers idle
+    return sorted(units, key=lambda unit: len(points(unit)), reverse=True)
+
+
+def nestedDict(d, keys):
+    #the dict at d[keys[0]][keys[1]]..., creating any that are missing
+    for key in keys:
+        d = d.setdefault(key, {})
+    return d
+
+
+def nestBuckets(buckets, partitions):
+    #dictClusterWinRate, dictRecords and dictClusterShapes from (partition, time, winRates, records, shapes) buckets
+    #every partition in partitions is there even if it has no buckets
+    dictClusterWinRate = {}
+    dictRecords = {}
+    dictClusterShapes = {}
+    for partition in partitions:
+        for nested in (dictClusterWinRate, dictRecords, dictClusterShapes):
+            nestedDict(nested, partition)
+
+    for partition, time, winRates, records, shapes in buckets:
+        nestedDict(dictClusterWinRate, partition)[time] = winRates
+        nestedDict(dictRecords, partition)[time] = records
+        nestedDict(dictClusterShapes, partition)[time] = shapes
+
+    return dictClusterWinRate, dictRecords, dictClusterShapes
+
+
+def workUnits(dictRecords, clusterOptions, period):
+    units = [(partition, time, recordPoints(records), records['win'].copy(), clusterOptions, metrics.profileDirectory(), period)
+             for partition, times in dictRecords.items() for time, records in times.items()]
+
+    return biggestFirst(units, lambda unit: unit[2])
+
+
+def clusterPartitions(dictRecords, workers=None, clusterOptions=None, period=None):
+    #cluster every time bucket of every partition, across a pool of workers unless workers is 1
+    #clusterOptions are passed on to clusterBucket, e.g. {'backend': 'graph'}, period only labels the buckets' metrics
+    #every record gets its 'cluster' label, returns dictClusterWinRate, dictRecords and dictClusterShapes nested by partition key
+    units = workUnits(dictRecords, clusterOptions or {}, period)
+
+    results = {}
+    for partition, time, labels, winRates, shapes, bucketMetrics in runUnits(runWorkUnit, units, workers):
+        metrics.recordBucket(partition, time, bucketMetrics, period)
+        results[(partition, time)] = (labels, winRates, shapes)
+
+    #merge back in partition and time order, so the output doesn't depend on which worker finished first
+    dictClusterWinRate = {}
+    nestedRecords = {}
+    dictClusterShapes = {}
+    for partition, times in dictRecords.items():
+        winRates = nestedDict(dictClusterWinRate, partition)
+        records = nestedDict(nestedRecords, partition)
+        shapes = nestedDict(dictClusterShapes, partition)
+
+        for time in times:
+            labels, winRates[time], shapes[time] = results[(partition, time)]
+
+            records[time] = dictRecords[partition][time]
+            records[time]['cluster'] = labels
+
+    print("Finished clustering " + str(len(units)) + " time buckets")
+    return dictClusterWinRate, nestedRecords, dictClusterShapes
+
+
+def streamPartitions(dictRecords, workers=None, clusterOptions=None, period=None):
+    #clusterPartitions, but yielding (partition, time, winRates, records, shapes) for each bucket as it's finished
+    #instead of collecting them all, buckets come biggest first
+    units = workUnits(dictRecords, clusterOptions or {}, period)
+
+    for partition, time, labels, winRates, shapes, bucketMetrics in runUnits(runWorkUnit, units, workers, ordered=True):
+        metrics.recordBucket(partition, time, bucketMetrics, period)
+        records = dictRecords[partition][time]
+        records['cluster'] = labels
+        yield partition, time, winRates, records, shapes
+
+    print("Finished clustering " + str(len(units)) + " time buckets")
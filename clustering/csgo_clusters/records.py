@@ -0,0 +1,182 @@
+## Point records
+##
+## Every clustered point is one row of a NumPy structured array, one array per
+## (partition, time) bucket, instead of a dict per point. Filenames and player
+## numbers are interned into tables shared by every bucket, and coordinates are
+## float32, which is what demos record them in, so they print back unchanged.
+## A position that isn't a plain {x, y, z} of numbers is kept whole in the
+## positions table instead.
+##
+## Buckets are filled a row at a time through an accumulator, which turns the
+## rows it holds into records every flushRows rows and, given a spill directory,
+## appends them to a file per bucket that's memory-mapped back at the end.
+##
+## writePositions writes the records out as the same clusterPositions.json the
+## front-end always had, a list of pointer dicts per bucket:
+##   {"round", "filename", "playerNumber", "team", "position", "win", "death", "cluster"}
+
+import json, os
+import numpy as np
+
+#bits of the coords column, set when the coordinate was an integer, or when the position is in the positions table
+xIsInt, yIsInt, zIsInt, inTable = 1, 2, 4, 8
+
+pointDtype = np.dtype([('x', np.float32), ('y', np.float32), ('z', np.float32), ('coords', np.uint8), ('position', np.int32),
+                       ('round', np.int32), ('file', np.int32), ('player', np.int32), ('team', np.int8), ('win', np.int8),
+                       ('died', np.bool_), ('deathRelativeTick', np.int64), ('deathTick', np.int64), ('cluster', np.int32)])
+
+
+def newTables(files=(), players=(), positions=()):
+    #interning tables, index of a value is its position in the list
+    return {'files': list(files), 'fileIndex': {name: i for i, name in enumerate(files)},
+            'players': list(players), 'playerIndex': {player: i for i, player in enumerate(players)},
+            'positions': list(positions)}
+
+
+def tablesToJson(tables):
+    return {'files': tables['files'], 'players': tables['players'], 'positions': tables['positions']}
+
+
+def tablesFromJson(saved):
+    return newTables(saved['files'], saved['players'], saved['positions'])
+
+
+def intern(tables, table, value):
+    index = tables[table + 'Index']
+    if value not in index:
+        index[value] = len(tables[table + 's'])
+        tables[table + 's'].append(value)
+    return index[value]
+
+
+def isColumnarPosition(position):
+    #only plain {x, y, z} positions round-trip exactly through the float columns
+    return (type(position) is dict and list(position.keys()) == ['x', 'y', 'z']
+            and all(type(value) in (int, float) for value in position.values()))
+
+
+def coordinateFlags(position):
+    return ((xIsInt if type(position['x']) is int else 0) | (yIsInt if type(position['y']) is int else 0)
+            | (zIsInt if type(position['z']) is int else 0))
+
+
+def pointRow(tables, position, roundNumber, filename, player, team, win, death):
+    #one record as a tuple in pointDtype order, the cluster is -1 until clustered
+    if isColumnarPosition(position):
+        x, y, z = position['x'], position['y'], position['z']
+        coords = coordinateFlags(position)
+        positionIndex = -1
+    else:
+        #kept whole for the output, x and y are still needed to cluster on
+        x, y, z = position['x'], position['y'], 0.0
+        coords = inTable
+        positionIndex = len(tables['positions'])
+        tables['positions'].append(position)
+
+    return (x, y, z, coords, positionIndex, roundNumber, intern(tables, 'file', filename), intern(tables, 'player', player),
+            team, win, death[0], death[1], death[2], -1)
+
+
+def toRecords(rows):
+    return np.array(rows, dtype=pointDtype)
+
+
+def newAccumulator(partitions, spillDirectory=None, flushRows=65536):
+    #per (partition, time) bucket accumulators, every partition in partitions is there even if it gets no rows
+    if spillDirectory is not None:
+        os.makedirs(spillDirectory, exist_ok=True)
+        #spill files of an earlier run
+        for name in os.listdir(spillDirectory):
+            if name.endswith('.records'):
+                os.remove(os.path.join(spillDirectory, name))
+    return {'buckets': {partition: {} for partition in partitions}, 'spillDirectory': spillDirectory,
+            'flushRows': flushRows, 'heldRows': 0, 'spilled': 0}
+
+
+def addRow(accumulator, partition, time, row):
+    times = accumulator['buckets'][partition]
+    if time not in times:
+        times[time] = {'rows': [], 'chunks': [], 'path': None, 'count': 0}
+    times[time]['rows'].append(row)
+
+    accumulator['heldRows'] += 1
+    if accumulator['heldRows'] >= accumulator['flushRows']:
+        flushRows(accumulator)
+
+
+def flushRows(accumulator):
+    #turn the rows of every bucket into records, kept as a chunk or appended to the bucket's spill file
+    for times in accumulator['buckets'].values():
+        for bucket in times.values():
+            if not bucket['rows']:
+                continue
+            records = toRecords(bucket['rows'])
+            bucket['rows'] = []
+            bucket['count'] += len(records)
+
+            if accumulator['spillDirectory'] is None:
+                bucket['chunks'].append(records)
+                continue
+            if bucket['path'] is None:
+                bucket['path'] = os.path.join(accumulator['spillDirectory'], 'bucket' + str(accumulator['spilled']) + '.records')
+                accumulator['spilled'] += 1
+            with open(bucket['path'], 'ab') as fp:
+                fp.write(records.tobytes())
+    accumulator['heldRows'] = 0
+
+
+def accumulatedRecords(accumulator):
+    #dictRecords of everything added, keyed by partition then time in the order times were first seen
+    #spilled buckets are copy-on-write memory maps of their file, so setting labels doesn't touch it
+    flushRows(accumulator)
+    dictRecords = {}
+    for partition, times in accumulator['buckets'].items():
+        dictRecords[partition] = {}
+        for time, bucket in times.items():
+            if bucket['path'] is not None:
+                dictRecords[partition][time] = np.memmap(bucket['path'], dtype=pointDtype, mode='c', shape=(bucket['count'],))
+            else:
+                dictRecords[partition][time] = np.concatenate(bucket['chunks'])
+    return dictRecords
+
+
+def recordPoints(records):
+    #the [x, y] of every record, as the float64 array clustering and hulls work on
+    return np.stack([records['x'], records['y']], axis=1).astype(np.float64)
+
+
+def positionJson(tables, x, y, z, coords, positionIndex):
+    if coords & inTable:
+        return json.dumps(tables['positions'][positionIndex])
+    return ('{"x": ' + (str(int(x)) if coords & xIsInt else repr(x)) + ', "y": ' + (str(int(y)) if coords & yIsInt else repr(y))
+            + ', "z": ' + (str(int(z)) if coords & zIsInt else repr(z)) + '}')
+
+
+def pointersJson(records, tables):
+    #the records as the JSON list of pointer dicts, exactly as json.dump would write the dicts
+    files = [json.dumps(name) for name in tables['files']]
+    players = [json.dumps(player) for player in tables['players']]
+    columns = [records[name].tolist() for name in pointDtype.names]
+
+    pointers = []
+    for (x, y, z, coords, positionIndex, roundNumber, fileNumber, player, team, win,
+         died, deathRelativeTick, deathTick, cluster) in zip(*columns):
+        pointers.append('{"round": %d, "filename": %s, "playerNumber": %s, "team": %d, "position": %s, "win": %d, "death": %s, "cluster": %d}'
+                        % (roundNumber, files[fileNumber], players[player], team, positionJson(tables, x, y, z, coords, positionIndex),
+                           win, ('[true, %d, %d]' % (deathRelativeTick, deathTick)) if died else '[false, -1, -1]', cluster))
+    return '[' + ', '.join(pointers) + ']'
+
+
+def writePositions(fp, dictRecords, tables):
+    #json.dump of the pointers of every bucket, nested by partition key then time, one bucket at a time
+    def write(nested):
+        if isinstance(nested, np.ndarray):
+            fp.write(pointersJson(nested, tables))
+            return
+        fp.write('{')
+        for i, (key, value) in enumerate(nested.items()):
+            fp.write((', ' if i else '') + json.dumps(str(key)) + ': ')
+            write(value)
+        fp.write('}')
+
+    write(dictRecords)
@@ -0,0 +1,191 @@
+## Clustering runs
+##
+## The stages of "CSGO Example Clustering Script.py" as functions, so a job can
+## run them without spawning the script and the CLI (python -m csgo_clusters,
+## see cli.py) can call them:
+##   ingest   parse the .dat files a state directory hasn't seen and recluster the time buckets they change
+##   export   write the output files of every time bucket in a state directory
+##   cluster  both, or without a state directory parse and cluster everything in one go
+##
+## Output goes in outputDirectory: clusterWinRates/Positions/Shapes.json for the
+## first time period and the same with the period in their name for the others,
+## or with sharded a manifest.json and packs per period (see output.py), the
+## first period's in outputDirectory and the others' in a directory named after
+## the period inside it.
+##
+## clusterOptions are clusterBucket's (see clusters.py), shapeOptions
+## {'tolerance', 'precision', 'binary'} (see shapes.py), trackOptions
+## {'searchDistance'} (see tracking.py) and sweepOptions {'eps', 'minSamples',
+## 'sampleSize'} (see sweep.py), which writes clusterSweep.json instead of clustering.
+
+import json, os
+
+from .incremental import savedBuckets, savedRecords, savedTables, updateState
+from .metrics import stage
+from .output import closeShards, openShards, writeShards
+from .parse import streamDirectory
+from .pipeline import clusterPartitions, nestBuckets, nestedDict, streamPartitions
+from .records import writePositions
+from .shapes import compactShapes, packShapesBinary, shapeStats
+from .snapshots import joinSnapshots, partitionKeys, periodName, timePeriod
+from .sweep import sweepPartitions
+from .tracking import clusterMembers, trackClusters
+
+
+def checkOutputOptions(sharded, shapeOptions):
+    #options that can't be written together, raised before anything is parsed or clustered
+    if sharded and (shapeOptions or {}).get('binary'):
+        raise ValueError("binary shapes are only written with the three JSON files, not with sharded output")
+
+
+def ingest(directory, stateDirectory, workers=None, cacheDirectory=None, clusterOptions=None, periods=(timePeriod,)):
+    #bring stateDirectory up to date with the .dat files in directory, returns the tables its records are interned in
+    return updateState(directory, stateDirectory, workers, cacheDirectory, clusterOptions, periods=periods)
+
+
+def export(stateDirectory, outputDirectory='.', periods=None, sharded=False, compression=None, shapeOptions=None, trackOptions=None,
+           sweepOptions=None, workers=None):
+    #write the output of every time bucket of periods in stateDirectory, every period the state has if None
+    checkOutputOptions(sharded, shapeOptions)
+    if periods is None:
+        with open(os.path.join(stateDirectory, 'state.json'), 'r') as fp:
+            periods = json.load(fp)['periods']
+
+    periodBuckets = {period: savedBuckets(stateDirectory, period=period) for period in periods}
+    periodRecords = {period: None for period in periods}
+    writeOutput(periodBuckets, periodRecords, savedTables(stateDirectory), outputDirectory, sharded, compression, shapeOptions,
+                trackOptions, sweepOptions, workers, stateDirectory=stateDirectory)
+
+
+def cluster(directory, outputDirectory='.', workers=None, cacheDirectory=None, stateDirectory=None, spillDirectory=None, clusterOptions=None,
+            periods=(timePeriod,), sharded=False, compression=None, shapeOptions=None, trackOptions=None, sweepOptions=None):
+    #cluster the .dat files in directory and write the output, only reclustering what new files change if there's a stateDirectory
+    checkOutputOptions(sharded, shapeOptions)
+    if stateDirectory is not None:
+
+        ##incremental: only new files are parsed and only the time buckets they add points to are clustered again
+
+        ingest(directory, stateDirectory, workers, cacheDirectory, clusterOptions, periods)
+        export(stateDirectory, outputDirectory, periods, sharded, compression, shapeOptions, trackOptions, sweepOptions, workers)
+        return
+
+    ##every round is joined with its winner, teams and deaths as soon as it ends and its points go straight to their time bucket
+    ##points are split by outcome then team, see partitionBy in snapshots.py to change this
+    ##every point is a row of a structured array, see records.py
+
+    with stage('parseJoin'):
+        periodRecords, tables, endState = joinSnapshots(streamDirectory(directory, workers, cacheDirectory),
+                                                        spillDirectory=spillDirectory, periods=periods)
+
+    print("Parsing files done")
+    print("Rounds parsed: " + str(endState['roundCount']))
+
+    ##cluster, find win rates and shapes for every partition and time at once, buckets are streamed out if sharding
+    periodBuckets = {period: streamPartitions(periodRecords[period], workers, clusterOptions, period) if sharded else None
+                     for period in periods}
+    writeOutput(periodBuckets, periodRecords, tables, outputDirectory, sharded, compression, shapeOptions, trackOptions, sweepOptions,
+                workers, clusterOptions)
+
+
+def writeOutput(periodBuckets, periodRecords, tables, outputDirectory='.', sharded=False, compression=None, shapeOptions=None,
+                trackOptions=None, sweepOptions=None, workers=None, clusterOptions=None, stateDirectory=None):
+    #write every period's output, each from its buckets, or from its records to cluster if it has no buckets
+    #(or from stateDirectory's records if it has neither, to sweep)
+    shapeOptions = shapeOptions or {}
+    compact = shapeOptions.get('tolerance') is not None or shapeOptions.get('precision') is not None
+    os.makedirs(outputDirectory, exist_ok=True)
+    periods = list(periodBuckets)
+
+    for period in periods:
+
+        #the first period goes where the front-end looks, the others next to it with the period in their name
+        suffix = '' if period == periods[0] else '.' + periodName(period)
+        buckets = periodBuckets[period]
+
+        if sweepOptions is not None:
+
+            ##try every DBSCAN setting of sweepOptions instead of clustering with clusterOptions
+
+            with stage('sweep'):
+                dictRecords = periodRecords.pop(period)
+                if dictRecords is None:
+                    dictRecords = savedRecords(stateDirectory, period=period)
+                sweep = sweepPartitions(dictRecords, workers, **sweepOptions)
+
+            with open(os.path.join(outputDirectory, 'clusterSweep' + suffix + '.json'), 'w') as fp:
+                json.dump(sweep, fp)
+
+            print("eps, minSamples, clusters per time bucket, noise fraction, silhouette (" + periodName(period) + "):")
+            for setting in sweep['settings']:
+                print("  " + str(setting['eps']) + ", " + str(setting['minSamples']) + ", " + str(round(setting['clustersPerBucket'], 2)) + ", "
+                      + str(round(setting['noiseFraction'], 3)) + ", " + (str(round(setting['silhouette'], 3)) if setting['silhouette'] is not None else "-"))
+            continue
+
+        if sharded:
+
+            #buckets are clustered as they're written, so this stage also covers clustering unless it's incremental
+            with stage('write'):
+                shards = openShards(os.path.join(outputDirectory, periodName(period)) if suffix else outputDirectory, compression,
+                                    timePeriod=period)
+                trackBuckets = []
+                for partition, time, winRates, records, shapes in buckets:
+                    if trackOptions is not None:
+                        trackBuckets.append((partition, time, shapes, clusterMembers(records)))
+                    if compact:
+                        shapes = compactShapes(shapes, shapeOptions.get('tolerance'), shapeOptions.get('precision'))
+                    writeShards(shards, partition, time, winRates, shapes, records, tables)
+                closeShards(shards)
+
+            if trackOptions is not None:
+                with stage('track'):
+                    dictClusterTracks = trackClusters(trackBuckets, partitionKeys(), period, **trackOptions)
+                with open(os.path.join(shards['directory'], 'clusterTracks.json'), 'w') as fp:
+                    json.dump(dictClusterTracks, fp)
+
+            continue
+
+        with stage('cluster' if buckets is None else 'readState'):
+            if buckets is None:
+                dictClusterWinRate, dictRecords, dictClusterShapes = clusterPartitions(periodRecords.pop(period), workers, clusterOptions, period)
+            else:
+                dictClusterWinRate, dictRecords, dictClusterShapes = nestBuckets(buckets, partitionKeys())
+
+        if trackOptions is not None:
+            #from the full hulls, before they're compacted for writing
+            with stage('track'):
+                dictClusterTracks = trackClusters(((partition, time, nestedDict(dictClusterShapes, partition)[time], clusterMembers(records))
+                                                   for partition in partitionKeys() for time, records in nestedDict(dictRecords, partition).items()),
+                                                  partitionKeys(), period, **trackOptions)
+
+        with stage('write'):
+            if compact:
+                dictClusterShapes = compactShapes(dictClusterShapes, shapeOptions.get('tolerance'), shapeOptions.get('precision'))
+
+            #packed before any file is opened, so shapes that don't fit in int16 stop the run with nothing half written
+            if shapeOptions.get('binary'):
+                shapesBinary = packShapesBinary(dictClusterShapes, shapeOptions.get('precision') or 0)
+
+            with open(os.path.join(outputDirectory, 'clusterWinRates' + suffix + '.json'), 'w') as fp:
+                json.dump(dictClusterWinRate, fp)
+
+            with open(os.path.join(outputDirectory, 'clusterPositions' + suffix + '.json'), 'w') as fp:
+                writePositions(fp, dictRecords, tables)
+
+            with open(os.path.join(outputDirectory, 'clusterShapes' + suffix + '.json'), 'w') as fp:
+                json.dump(dictClusterShapes, fp)
+
+            if trackOptions is not None:
+                with open(os.path.join(outputDirectory, 'clusterTracks' + suffix + '.json'), 'w') as fp:
+                    json.dump(dictClusterTracks, fp)
+
+            if shapeOptions.get('binary'):
+                with open(os.path.join(outputDirectory, 'clusterShapes' + suffix + '.bin'), 'wb') as fp:
+                    fp.write(shapesBinary)
+                print("clusterShapes" + suffix + ".bin: " + str(len(shapesBinary)) + " bytes")
+
+    print("Finished writing to files")
+
+    stats = shapeStats()
+    if stats is not None:
+        print("Shapes: " + str(stats['shapes']) + " hulls, " + str(stats['shapeVertices']) + " -> " + str(stats['compactShapeVertices']) + " vertices, "
+              + str(stats['shapeBytes']) + " -> " + str(stats['compactShapeBytes']) + " bytes of JSON")
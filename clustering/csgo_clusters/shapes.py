@@ -0,0 +1,142 @@
+## Compact cluster shapes
+##
+## The hulls in clusterShapes.json have a vertex for every boundary point of a
+## cluster, written as full precision doubles. compactShapes simplifies every
+## hull to within tolerance map units, keeping it a valid polygon that doesn't
+## cross itself, and rounds its coordinates to precision decimal places (whole
+## map units, written as integers, at 0). The shapes keep their layout,
+## {partition...: {time: {cluster: [[x, y], ...]}}}, so the viewer reads them as
+## before, there are just fewer and shorter numbers in them. It's done when the
+## shapes are written, the hulls clustering keeps (e.g. in incremental state)
+## are left as they are.
+##
+## packShapesBinary encodes the same shapes as clusterShapes.bin:
+##   8 bytes      b'CSGOSHP1'
+##   uint32       length of the index, little-endian
+##   index        JSON, {'scale': 10 ** precision, 'shapes': the shapes with [start, vertices] for every cluster}
+##   int16 pairs  little-endian, every shape's first vertex times scale, then each next vertex minus the one before
+## A shape's ring isn't closed in the file, readShapesBinary closes it again.
+
+import json, struct
+import numpy as np
+
+import shapely.geometry as geometry
+
+try:
+    from shapely import set_precision
+except ImportError: #Shapely 1
+    set_precision = None
+
+from . import metrics
+
+binaryMagic = b'CSGOSHP1'
+
+
+def roundCoordinate(value, precision):
+    return int(round(value)) if precision == 0 else round(value, precision)
+
+
+def compactShape(coords, tolerance=0, precision=None):
+    #the exterior coordinates of one hull, simplified to within tolerance and rounded to precision decimal places
+    polygon = geometry.Polygon(coords)
+    if tolerance:
+        simplified = polygon.simplify(tolerance, preserve_topology=True)
+        if type(simplified) is geometry.Polygon and not simplified.is_empty:
+            polygon = simplified
+
+    if precision is not None:
+        #snapping to the grid can make edges touch, set_precision fixes the polygon up as it snaps
+        if set_precision is not None:
+            snapped = set_precision(polygon, 10.0 ** -precision)
+        else:
+            snapped = geometry.Polygon([(round(x, precision), round(y, precision)) for x, y in polygon.exterior.coords]).buffer(0)
+        #a hull thinner than the grid has nothing left, so it keeps its unsnapped vertices and is only rounded
+        if type(snapped) is geometry.Polygon and not snapped.is_empty:
+            polygon = snapped
+
+        return [[roundCoordinate(x, precision), roundCoordinate(y, precision)] for x, y in polygon.exterior.coords]
+
+    return [list(xy) for xy in polygon.exterior.coords]
+
+
+def compactShapes(dictClusterShapes, tolerance=0, precision=None):
+    #compactShape of every hull in nested shapes, one bucket or a whole file's, the vertices and JSON bytes before and
+    #after are added to the run's counters
+    compact = {}
+    for key, value in dictClusterShapes.items():
+        if isinstance(value, dict):
+            compact[key] = compactShapes(value, tolerance, precision)
+            continue
+
+        compact[key] = compactShape(value, tolerance, precision)
+        metrics.count('shapes')
+        metrics.count('shapeVertices', len(value))
+        metrics.count('compactShapeVertices', len(compact[key]))
+        metrics.count('shapeBytes', len(json.dumps(value)))
+        metrics.count('compactShapeBytes', len(json.dumps(compact[key])))
+    return compact
+
+
+def shapeStats():
+    #vertices and bytes of the shapes compactShapes has seen this run, None if it hasn't seen any
+    counters = metrics.run['counters']
+    if not counters.get('shapes'):
+        return None
+    return {name: counters.get(name, 0) for name in ('shapes', 'shapeVertices', 'compactShapeVertices', 'shapeBytes', 'compactShapeBytes')}
+
+
+def packShapesBinary(dictClusterShapes, precision=0):
+    #nested shapes as the bytes of clusterShapes.bin, delta-encoded int16 vertices of coordinates rounded to precision decimal places
+    #raises ValueError if a shape doesn't fit in int16 at precision, before anything is written
+    scale = 10 ** precision
+    chunks = []
+    written = [0]
+
+    def encode(nested):
+        index = {}
+        for key, value in nested.items():
+            if isinstance(value, dict):
+                index[key] = encode(value)
+                continue
+
+            #the ring's closing vertex is the first one again
+            vertices = np.rint(np.asarray(value, dtype=np.float64)[:-1] * scale).astype(np.int64)
+            deltas = np.concatenate([vertices[:1], np.diff(vertices, axis=0)])
+            if len(deltas) and np.abs(deltas).max() > np.iinfo(np.int16).max:
+                raise ValueError("shape " + str(key) + " doesn't fit in int16 at precision " + str(precision) + ", use a lower shape precision")
+
+            index[key] = [written[0], len(deltas)]
+            chunks.append(deltas.astype('<i2').tobytes())
+            written[0] += len(deltas)
+        return index
+
+    index = json.dumps({'scale': scale, 'shapes': encode(dictClusterShapes)}).encode('utf8')
+    return b''.join([binaryMagic, struct.pack('<I', len(index)), index] + chunks)
+
+
+def readShapesBinary(fp):
+    #the nested shapes back from packShapesBinary, as compactShapes wrote them at the same precision
+    data = fp.read()
+    if data[:len(binaryMagic)] != binaryMagic:
+        raise ValueError("not a cluster shapes file")
+    length, = struct.unpack_from('<I', data, len(binaryMagic))
+    start = len(binaryMagic) + 4
+    index = json.loads(data[start:start + length].decode('utf8'))
+    vertices = np.frombuffer(data, dtype='<i2', offset=start + length).reshape(-1, 2)
+
+    scale = index['scale']
+    precision = int(round(np.log10(scale)))
+
+    def decode(nested):
+        shapes = {}
+        for key, value in nested.items():
+            if isinstance(value, dict):
+                shapes[key] = decode(value)
+                continue
+
+            offset, count = value
+            ring = np.cumsum(vertices[offset:offset + count].astype(np.int64), axis=0).tolist()
+            shapes[key] = [[roundCoordinate(x / scale, precision), roundCoordinate(y / scale, precision)] for x, y in ring + ring[:1]]
+        return shapes
+
+    return decode(index['shapes'])
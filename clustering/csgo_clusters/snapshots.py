@@ -0,0 +1,182 @@
+## Snapshots to clustering data
+##
+## Joins parsed snapshots with their round's winner, team and deaths, and splits
+## the points into partitions, one set of time buckets per partition key. Which
+## fields partition the data is configuration: every name in partitionBy must
+## have a function in partitionFields giving a point's value for it, and a list
+## in partitionValues giving the values kept (in output order).
+##
+## The points of every bucket are returned as structured arrays of point
+## records (see records.py) rather than dicts. Time buckets can be any multiple
+## of the parser's tracePeriod, several periods come from the same parse.
+##
+## joinSnapshots does the same while the files are being parsed: a round is
+## joined as soon as its round_end is parsed and its points go into their
+## buckets' accumulators, so only the round in progress is held as snapshots.
+## A round that never ends is dropped once a later round starts or the match
+## restarts, as partitionSnapshots drops it for having no winner.
+
+import os
+
+from .parse import newParseState, tracePeriod, windowTime
+from .records import accumulatedRecords, addRow, newAccumulator, newTables, pointRow
+
+outcomeNames = {1: 'win', -1: 'loss'} #draws (0) aren't clustered
+
+partitionFields = {
+    'outcome': lambda pointer: outcomeNames.get(pointer['win']),
+    'team': lambda pointer: pointer['team'],
+}
+
+partitionValues = {
+    'outcome': ['win', 'loss'],
+    'team': [2, 3], #terrorists, counter terrorists
+}
+
+partitionBy = ('outcome', 'team')
+
+timePeriod = 2 #seconds per time bucket unless other periods are asked for
+
+
+def partitionKeys(partitionBy=partitionBy):
+    #every partition key in output order, e.g. ('win', 2), ('win', 3), ('loss', 2), ('loss', 3)
+    keys = [()]
+    for field in partitionBy:
+        keys = [key + (value,) for key in keys for value in partitionValues[field]]
+    return keys
+
+
+def snapshotRows(output, playerTeams, playerDeaths, listOfWinningTeams, partitionBy, tables):
+    #(partition, time, row) of every point in output that's kept, in output order
+    fields = [(partitionFields[field], set(partitionValues[field])) for field in partitionBy]
+
+    for timeData in output:
+
+        for key in timeData[1].keys():
+
+            ##if we have a winner add this to data we'll track,
+            ##otherwise ignore, its likely players messing around after rounds end but before server closes
+            if (timeData[1][key][1] not in listOfWinningTeams):
+                continue
+
+            #did this player die? (first death in the round)
+            death = playerDeaths.get((timeData[1][key][1], key))
+            if (death is not None):
+                thisDeath = [True, death[1], death[0]]
+            else:
+                thisDeath = [False,-1,-1]
+
+            #find team of this player, players with no spawn this round get team 0 and are ignored
+            thisTeam = playerTeams.get((timeData[1][key][1], key), 0)
+            if (thisTeam == 0): #if team is 0, ignore it is probably just a non-game state of setting up teams
+                continue
+            if (thisTeam != 2 and thisTeam != 3):
+                raise Exception("unrecognised team")
+
+            #find which team won
+            winner = listOfWinningTeams[timeData[1][key][1]]
+            if (winner == thisTeam):
+                thisWin = 1
+            elif (winner == 1):
+                thisWin = 0 #0 winner indicates draw
+            else:
+                thisWin = -1
+
+            #partitionFields see the point as the pointer dict clusterPositions.json holds for it
+            pointer = {'round':timeData[1][key][1], 'filename':timeData[1][key][2], 'playerNumber': key, 'team':thisTeam, 'position': timeData[1][key][0],
+                       'win': thisWin, 'death': thisDeath }
+
+            partition = tuple(field(pointer) for field, values in fields)
+            if not all(value in values for value, (field, values) in zip(partition, fields)):
+                continue
+
+            yield partition, timeData[0], pointRow(tables, timeData[1][key][0], timeData[1][key][1], timeData[1][key][2],
+                                                   key, thisTeam, thisWin, thisDeath)
+
+
+def periodName(period):
+    #e.g. '2s', the name a time period's output goes under
+    return '%gs' % period
+
+
+def downsample(output, period=timePeriod):
+    #snapshots of period seconds put together from the parser's snapshots of tracePeriod seconds
+    #each player keeps their last position, in the order they first appear, as if the parser had recorded this period
+    #a window is only kept if the round got past its end, which it did if the parser output the last of its snapshots
+    factor = int(round(period / tracePeriod))
+    if factor < 1 or abs(factor * tracePeriod - period) > 1e-9 * period:
+        raise ValueError("time period " + str(period) + " isn't a multiple of tracePeriod " + str(tracePeriod))
+    if factor == 1:
+        return output
+
+    downsampled = []
+    merged = None
+    for time, positions, roundNumber in output:
+        window = int(round(time / windowTime(1)))
+        if (window - 1) % factor == 0:
+            merged, mergedRound = {}, roundNumber
+        elif merged is None or mergedRound != roundNumber:
+            #the start of this window was never seen
+            continue
+
+        merged.update(positions)
+        if window % factor == 0:
+            downsampled.append([windowTime(window // factor, period), merged, roundNumber])
+            merged = None
+    return downsampled
+
+
+def partitionSnapshots(output, playerTeams, playerDeaths, listOfWinningTeams, partitionBy=partitionBy, tables=None, period=timePeriod):
+    #returns dictRecords of time buckets of period seconds, keyed by partition key then time,
+    #and the tables its filenames and players are interned in
+    #tables carries on interning into the tables of an earlier call, so records of both can be mixed
+    if tables is None:
+        tables = newTables()
+    accumulator = newAccumulator(partitionKeys(partitionBy))
+    for partition, time, row in snapshotRows(downsample(output, period), playerTeams, playerDeaths, listOfWinningTeams, partitionBy, tables):
+        addRow(accumulator, partition, time, row)
+    return accumulatedRecords(accumulator), tables
+
+
+def pendingSnapshots(output, endState):
+    #snapshots of the round still running at endState, they're joined once a later result ends it
+    if endState['mostRecentStart'] == -1:
+        return []
+    return [snapshot for snapshot in output if snapshot[2] == endState['roundCount']]
+
+
+def joinSnapshots(results, partitionBy=partitionBy, tables=None, spillDirectory=None, periods=(timePeriod,)):
+    #partitionSnapshots of parse results as they come (see streamRounds in parse.py), so only the round still running
+    #is held as snapshots and every other point goes straight into its bucket's accumulator
+    #every period in periods is put together from the same snapshots, spilled to a directory per period
+    #returns {period: dictRecords}, tables and the endState after the last result
+    if tables is None:
+        tables = newTables()
+    accumulators = {period: newAccumulator(partitionKeys(partitionBy),
+                                           os.path.join(spillDirectory, periodName(period)) if spillDirectory is not None else None)
+                    for period in periods}
+    pending = []
+    playerTeams = {}
+    playerDeaths = {}
+    endState = newParseState()
+
+    for result in results:
+        #later results win for teams and earlier ones for deaths, as when they're merged
+        playerTeams.update(result['playerTeams'])
+        for key, death in result['playerDeaths'].items():
+            playerDeaths.setdefault(key, death)
+
+        #a round's teams and deaths are all known by the time it ends, so it can be joined then
+        output = pending + result['output']
+        for period in periods:
+            for partition, time, row in snapshotRows(downsample(output, period), playerTeams, playerDeaths,
+                                                     result['listOfWinningTeams'], partitionBy, tables):
+                addRow(accumulators[period], partition, time, row)
+
+        #rounds before the current one can't end any more, their snapshots, teams and deaths are dropped
+        endState = result['endState']
+        pending = pendingSnapshots(output, endState)
+        playerTeams = {key: team for key, team in playerTeams.items() if key[0] >= endState['roundCount']}
+        playerDeaths = {key: death for key, death in playerDeaths.items() if key[0] >= endState['roundCount']}
+
+    return {period: accumulatedRecords(accumulator) for period, accumulator in accumulators.items()}, tables, endState
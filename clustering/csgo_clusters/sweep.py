@@ -0,0 +1,293 @@
+## DBSCAN parameter sweep
+##
+## Tries every (eps, minSamples) of a grid on every time bucket without
+## clustering from scratch each time. The neighbour pairs of a bucket are found
+## once, with a KD-tree at the largest eps, and everything else comes from them.
+## The eps of the grid are levels, a pair's level is the lowest eps it's within:
+##   - a point is core at eps if its minSamples-th nearest neighbour (itself
+##     included) is within eps, so one nearest neighbour query gives the level it
+##     turns core at for every minSamples
+##   - two core points are joined at eps if they're within eps of each other, so
+##     a pair joins its points from the highest of its level and their core levels
+##     up. Pairs of points core at that level even for the largest minSamples join
+##     them for every minSamples, they're put together once, as each level's
+##     components, while the pairs are queried. Only the rest are kept, and the
+##     clusters at a setting are those components joined by the kept pairs whose
+##     level is low enough
+##   - border points take the lowest numbered cluster among their core
+##     neighbours, and clusters are numbered by their lowest core point, which
+##     gives the labels sklearn's DBSCAN and the 'graph' backend would
+## Distances are compared squared, as the KD-tree does, so the neighbours within
+## eps are exactly the ones a DBSCAN run at eps would find.
+##
+## Every setting is scored on its cluster count, noise fraction and silhouette
+## (sklearn.metrics, over the clustered points of a random sample of each
+## bucket whose distances are worked out once, settings that label the sample
+## the same share it), and sweepPartitions adds the scores of all buckets up:
+##   {'eps', 'minSamples', 'clusters', 'clustersPerBucket', 'noiseFraction', 'silhouette'}
+## silhouette is the mean over buckets with at least two clusters, weighted by
+## their clustered points, None if there were none.
+
+import itertools, time as timer
+import numpy as np
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.metrics import pairwise_distances, silhouette_score
+from sklearn.neighbors import KDTree
+
+from .pipeline import biggestFirst, runUnits
+from .records import recordPoints
+
+
+def pairLevels(points, rows, columns, limits):
+    #index of the first of limits (squared eps, ascending) every pair's squared distance is within, len(limits) if none
+    #squared as the KD-tree does, so a pair is within eps exactly when a DBSCAN run at eps finds it
+    dx = points[rows, 0] - points[columns, 0]
+    dy = points[rows, 1] - points[columns, 1]
+    return np.searchsorted(limits, dx * dx + dy * dy, side='left').astype(np.int16)
+
+
+def coreLevels(tree, points, limits, minSamplesValues):
+    #the first level every point is core at for each of minSamplesValues (ascending), len(limits) if it never is
+    #from the point's nearest max(minSamplesValues) neighbours (itself included): it's core at a level once minSamples
+    #of them are within it
+    pointCount = len(points)
+    levels = np.full((len(minSamplesValues), pointCount), len(limits), dtype=np.int16)
+    k = min(max(minSamplesValues), pointCount)
+    neighbours = tree.query(points, k=k, return_distance=False)
+    neighbourLevels = pairLevels(points, np.repeat(np.arange(pointCount), k), neighbours.ravel(), limits).reshape(pointCount, k)
+
+    #neighbours within every level, counted up
+    within = np.cumsum(np.stack([np.count_nonzero(neighbourLevels == level, axis=1) for level in range(len(limits))], axis=1), axis=1)
+    for i, minSamples in enumerate(minSamplesValues):
+        enough = within >= minSamples
+        levels[i] = np.where(enough.any(axis=1), enough.argmax(axis=1), len(limits))
+    return levels
+
+
+def findRoots(parent, points):
+    #the root of every one of points in the forest parent, which points each point on its way there at its root
+    roots = parent[points]
+    while True:
+        above = parent[roots]
+        if np.array_equal(above, roots):
+            break
+        roots = above
+    parent[points] = roots
+    return roots
+
+
+def joinLevels(parents, rows, columns, levels):
+    #join the pairs (rows, columns) in parents[level], a forest over the points for every level, from each pair's level up
+    #a level's components are unions of the level below's, so only pairs that joined something at the level below
+    #need joining again at the next, the work doesn't grow with the number of points
+    order = np.argsort(levels, kind='stable')
+    bounds = np.searchsorted(levels[order], np.arange(len(parents) + 1), side='left')
+    fromPoints = toPoints = np.zeros(0, dtype=rows.dtype)
+    for level, parent in enumerate(parents):
+        pair = order[bounds[level]:bounds[level + 1]]
+        fromPoints = np.concatenate([fromPoints, rows[pair]])
+        toPoints = np.concatenate([toPoints, columns[pair]])
+        fromRoots, toRoots = findRoots(parent, fromPoints), findRoots(parent, toPoints)
+
+        #pairs already in the same component have nothing left to join
+        apart = fromRoots != toRoots
+        fromPoints, toPoints, fromRoots, toRoots = fromPoints[apart], toPoints[apart], fromRoots[apart], toRoots[apart]
+        if len(fromRoots):
+            roots, inverse = np.unique(np.concatenate([fromRoots, toRoots]), return_inverse=True)
+            graph = csr_matrix((np.ones(len(fromRoots), dtype=np.int32), (inverse[:len(fromRoots)], inverse[len(fromRoots):])),
+                               shape=(len(roots), len(roots)))
+            count, joined = connected_components(graph, directed=False)
+            #every root joined to others points at the lowest of them
+            lowest = np.full(count, len(parent), dtype=parent.dtype)
+            np.minimum.at(lowest, joined, roots)
+            parent[roots] = lowest[joined]
+
+
+def sweepGraph(points, epsValues, minSamplesValues, chunkEntries=250000):
+    #everything sweepLabels needs from the neighbours of one bucket's points, epsValues and minSamplesValues ascending
+    #neighbour pairs within the largest eps are queried a chunk of points at a time (about chunkEntries pairs), pairs
+    #that join at the same level whatever minSamples is are joined into components straight away and only the rest kept
+    limits = np.array([float(eps) * float(eps) for eps in epsValues])
+    levelCount = len(limits)
+    pointCount = len(points)
+    graph = {'eps': list(epsValues), 'minSamples': list(minSamplesValues)}
+    parents = [np.arange(pointCount) for level in range(levelCount)]
+    treePairs = [np.zeros((3, 0), dtype=np.int32)]
+    borderPairs = [np.zeros((3, 0), dtype=np.int32)]
+    if pointCount == 0:
+        graph['core'] = np.zeros((len(minSamplesValues), 0), dtype=np.int16)
+        graph['tree'] = graph['border'] = treePairs[0]
+        graph['components'], graph['counts'] = parents, [0] * levelCount
+        return graph
+
+    tree = KDTree(points)
+    graph['core'] = coreLevels(tree, points, limits, minSamplesValues)
+    most = graph['core'][-1]
+    ever = graph['core'][0] < levelCount
+
+    start = 0
+    entries = 0
+    chunkPoints = 64
+    while start < pointCount:
+        end = min(pointCount, start + chunkPoints)
+        neighbours = tree.query_radius(points[start:end], float(epsValues[-1]))
+        lengths = np.fromiter((len(n) for n in neighbours), dtype=np.int64, count=len(neighbours))
+        rows = np.repeat(np.arange(start, end, dtype=np.int32), lengths)
+        columns = np.concatenate(neighbours).astype(np.int32)
+        entries += len(rows)
+
+        #two points core at the first level for every minSamples, already joined at it, are joined at every level and
+        #neither can be a border point, which is most pairs inside a crowd, so they're dropped before working out levels
+        rowMost, columnMost = most[rows], most[columns]
+        joined = findRoots(parents[0], np.arange(pointCount))
+        kept = (rowMost > 0) | (columnMost > 0) | (joined[rows] != joined[columns])
+        rows, columns, rowMost, columnMost = rows[kept], columns[kept], rowMost[kept], columnMost[kept]
+        levels = pairLevels(points, rows, columns, limits)
+        columnEver = ever[columns]
+
+        #pairs whose points are both core at the pair's own level for every minSamples join at that level whatever minSamples is
+        upper = rows < columns
+        fixed = upper & (np.maximum(rowMost, columnMost) <= levels)
+        joinLevels(parents, rows[fixed], columns[fixed], levels[fixed])
+
+        #the others join at the highest of their level and their points' core levels, if both points are ever core
+        other = upper & ~fixed & ever[rows] & columnEver
+        treePairs.append(np.stack([rows[other], columns[other], levels[other]]))
+
+        #a point can be a border point of a neighbour's cluster at the levels it isn't core at for every minSamples
+        border = (rowMost > levels) & columnEver
+        borderPairs.append(np.stack([rows[border], columns[border], levels[border]]))
+
+        #the next chunk is sized from the pairs per point so far
+        chunkPoints = max(1, int(end * chunkEntries / max(entries, 1)))
+        start = end
+
+    #every point's component at every level, numbered from 0
+    graph['components'], graph['counts'] = [], []
+    for parent in parents:
+        roots, components = np.unique(findRoots(parent, np.arange(pointCount)), return_inverse=True)
+        graph['components'].append(components)
+        graph['counts'].append(len(roots))
+    graph['tree'] = np.concatenate(treePairs, axis=1)
+    graph['border'] = np.concatenate(borderPairs, axis=1)
+    return graph
+
+
+def sweepLabels(graph):
+    #(eps, minSamples, DBSCAN labels) of every setting of a sweepGraph, minSamples ascending then eps ascending
+    #clusters are the components of the core points at eps, numbered by their lowest core point as sklearn numbers them,
+    #and border points take the lowest numbered cluster among their core neighbours
+    pointCount = graph['core'].shape[1]
+    treeRows, treeColumns, treeLevels = graph['tree']
+    borderRows, borderColumns, borderLevels = graph['border']
+
+    for core, minSamples in zip(graph['core'], graph['minSamples']):
+        joinedLevels = np.maximum(treeLevels, np.maximum(core[treeRows], core[treeColumns]))
+        rowCore, columnCore = core[borderRows], core[borderColumns]
+
+        for level, eps in enumerate(graph['eps']):
+            labels = np.full(pointCount, -1, dtype=np.intp)
+            coreIndex = np.flatnonzero(core <= level)
+            if len(coreIndex) == 0:
+                yield eps, minSamples, labels
+                continue
+
+            components = graph['components'][level]
+            pair = joinedLevels <= level
+            if pair.any():
+                count = graph['counts'][level]
+                joined = connected_components(csr_matrix((np.ones(np.count_nonzero(pair), dtype=np.int32),
+                                                          (components[treeRows[pair]], components[treeColumns[pair]])), shape=(count, count)),
+                                              directed=False)[1]
+                clusters = joined[components[coreIndex]]
+            else:
+                clusters = components[coreIndex]
+
+            first, inverse = np.unique(clusters, return_index=True, return_inverse=True)[1:]
+            rank = np.empty(len(first), dtype=np.intp)
+            rank[np.argsort(first)] = np.arange(len(first))
+            labels[coreIndex] = rank[inverse]
+
+            reached = (borderLevels <= level) & (columnCore <= level) & (rowCore > level)
+            if reached.any():
+                lowest = np.full(pointCount, pointCount, dtype=np.intp)
+                np.minimum.at(lowest, borderRows[reached], labels[borderColumns[reached]])
+                labels[lowest < pointCount] = lowest[lowest < pointCount]
+            yield eps, minSamples, labels
+
+
+def sweepBucket(points, epsValues, minSamplesValues, sampleSize=300, seed=0):
+    #scores of every (eps, minSamples) for one bucket, and the seconds spent on each step
+    seconds = {'neighbours': 0.0, 'labels': 0.0, 'scores': 0.0}
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+    start = timer.perf_counter()
+    graph = sweepGraph(points, sorted(epsValues), sorted(minSamplesValues))
+    seconds['neighbours'] += timer.perf_counter() - start
+
+    #the silhouette sample and its distances are shared by every setting
+    start = timer.perf_counter()
+    sample = np.sort(np.random.RandomState(seed).permutation(len(points))[:sampleSize])
+    sampleDistances = pairwise_distances(points[sample])
+    silhouettes = {}
+    seconds['scores'] += timer.perf_counter() - start
+
+    results = []
+    start = timer.perf_counter()
+    for eps, minSamples, labels in sweepLabels(graph):
+        seconds['labels'] += timer.perf_counter() - start
+
+        start = timer.perf_counter()
+        sampleLabels = labels[sample]
+        clustered = np.flatnonzero(sampleLabels != -1)
+        key = sampleLabels.tobytes()
+        if key not in silhouettes:
+            silhouettes[key] = None
+            if 2 <= len(np.unique(sampleLabels[clustered])) < len(clustered):
+                silhouettes[key] = float(silhouette_score(sampleDistances[np.ix_(clustered, clustered)], sampleLabels[clustered],
+                                                          metric='precomputed'))
+        results.append({'eps': eps, 'minSamples': minSamples, 'points': len(points), 'clusters': int(labels.max()) + 1 if len(labels) else 0,
+                        'noise': int((labels == -1).sum()), 'silhouette': silhouettes[key], 'silhouettePoints': len(clustered)})
+        seconds['scores'] += timer.perf_counter() - start
+        start = timer.perf_counter()
+
+    return results, seconds
+
+
+def runSweepUnit(unit):
+    partition, time, points, epsValues, minSamplesValues, sampleSize = unit
+    results, seconds = sweepBucket(points, epsValues, minSamplesValues, sampleSize)
+    return partition, time, results, seconds
+
+
+def sweepPartitions(dictRecords, workers=None, eps=(40, 60, 80, 100, 120), minSamples=(10, 20, 30, 40, 50), sampleSize=300):
+    #scores of every (eps, minSamples) over every time bucket of every partition, across a pool of workers unless workers is 1
+    #returns the totals of every setting and every bucket's own results
+    units = [(partition, time, recordPoints(records), list(eps), list(minSamples), sampleSize)
+             for partition, times in dictRecords.items() for time, records in times.items()]
+    units = biggestFirst(units, lambda unit: unit[2])
+
+    buckets = []
+    seconds = {}
+    for partition, time, results, bucketSeconds in runUnits(runSweepUnit, units, workers):
+        buckets.append({'partition': list(partition), 'time': time, 'results': results})
+        for step, value in bucketSeconds.items():
+            seconds[step] = seconds.get(step, 0.0) + value
+    buckets.sort(key=lambda bucket: (str(bucket['partition']), bucket['time']))
+
+    settings = []
+    for epsValue, minSamplesValue in itertools.product(sorted(eps), sorted(minSamples)):
+        results = [result for bucket in buckets for result in bucket['results']
+                   if result['eps'] == epsValue and result['minSamples'] == minSamplesValue]
+        points = sum(result['points'] for result in results)
+        scored = [result for result in results if result['silhouette'] is not None]
+        weight = sum(result['silhouettePoints'] for result in scored)
+        settings.append({'eps': epsValue, 'minSamples': minSamplesValue, 'clusters': sum(result['clusters'] for result in results),
+                         'clustersPerBucket': sum(result['clusters'] for result in results) / len(results) if results else 0.0,
+                         'noiseFraction': sum(result['noise'] for result in results) / points if points else 0.0,
+                         'silhouette': sum(result['silhouette'] * result['silhouettePoints'] for result in scored) / weight if weight else None})
+
+    print("Swept " + str(len(settings)) + " settings over " + str(len(units)) + " time buckets")
+    return {'settings': settings, 'seconds': seconds, 'buckets': buckets}
@@ -0,0 +1,115 @@
+## Cluster tracking
+##
+## Every time bucket is clustered on its own, so cluster 1 at one time has
+## nothing to do with cluster 1 at the next. trackClusters links the clusters of
+## each bucket to those of the next bucket of the same partition (one time
+## period later), giving every cluster a track ID that carries on while the
+## group moves, and the transition edges between them, splits and merges included.
+##
+## Candidates for a cluster are only the next bucket's hulls whose bounding boxes
+## come within searchDistance map units of its own, found with an STRtree built
+## once per bucket, rather than every pair of clusters. A candidate is an edge if
+## the hulls overlap or the clusters share a (round, player) point. Each track
+## then carries on to the successor it shares the most players with (ties going
+## to the larger overlap), and a cluster no track carries on to starts a new one.
+##
+## The output is nested by partition like the other files:
+##   tracks['win']['2'] = {'tracks': {time: {cluster: trackId}},
+##                         'edges': [[time, cluster, nextTime, nextCluster, overlap, shared], ...]}
+## overlap is the area the hulls share over the smaller one's area, shared the
+## number of (round, player) points the clusters have in common.
+
+import numpy as np
+
+import shapely
+from shapely.strtree import STRtree
+
+from .parse import windowTime
+from .pipeline import nestedDict
+
+
+def clusterMembers(records):
+    #{str(label): sorted (round, player) keys} of every cluster in one bucket of point records, as bucketHulls keys them
+    labels = np.asarray(records['cluster'])
+    keys = (records['round'].astype(np.int64) << 32) | records['player'].astype(np.int64)
+    members = {}
+    for label in np.unique(labels[labels != -1]).tolist():
+        members[str(label)] = np.unique(keys[labels == label])
+    return members
+
+
+def bucketPolygons(shapes, members):
+    #(clusters, polygons, areas, members) of one bucket, clusters in a fixed order so indices from the STRtree map back
+    clusters = sorted(shapes, key=int)
+    polygons = np.array([shapely.polygons(shapes[cluster]) for cluster in clusters], dtype=object)
+    return clusters, polygons, shapely.area(polygons), [members.get(cluster, np.empty(0, dtype=np.int64)) for cluster in clusters]
+
+
+def matchBuckets(bucket, nextBucket, searchDistance=0):
+    #edges (cluster, nextCluster, overlap, shared) between the clusters of two buckets, each from bucketPolygons
+    clusters, polygons, areas, members = bucket
+    nextClusters, nextPolygons, nextAreas, nextMembers = nextBucket
+    if not clusters or not nextClusters:
+        return []
+
+    #every cluster's bounding box, grown by searchDistance, against the tree of the next bucket's hulls in one query
+    boxes = shapely.box(*(shapely.bounds(polygons) + [-searchDistance, -searchDistance, searchDistance, searchDistance]).T)
+    queried, candidates = STRtree(nextPolygons).query(boxes)
+    order = np.lexsort((candidates, queried))
+    queried, candidates = queried[order], candidates[order]
+
+    smaller = np.minimum(areas[queried], nextAreas[candidates])
+    intersections = shapely.area(shapely.intersection(polygons[queried], nextPolygons[candidates]))
+    overlap = np.divide(intersections, smaller, out=np.zeros(len(smaller)), where=smaller > 0)
+
+    edges = []
+    for i, j, pairOverlap in zip(queried.tolist(), candidates.tolist(), overlap.tolist()):
+        sharedMembers = len(np.intersect1d(members[i], nextMembers[j], assume_unique=True))
+        if pairOverlap > 0 or sharedMembers > 0:
+            edges.append((clusters[i], nextClusters[j], pairOverlap, sharedMembers))
+    return edges
+
+
+def trackPartition(buckets, step, searchDistance=0):
+    #track IDs and edges of one partition, from {time: (shapes, members)}, buckets step ticks apart are linked
+    tracks = {}
+    edges = []
+    trackCount = 0
+    previousBucket = None
+    for time in sorted(buckets):
+        tracks[time] = {}
+        previous = tracks.get(time - step)
+        bucket = bucketPolygons(*buckets[time])
+        bucketEdges = matchBuckets(previousBucket, bucket, searchDistance) if previous is not None else []
+        previousBucket = bucket
+
+        #every track carries on to at most one cluster, strongest edges first
+        continued = set()
+        for cluster, nextCluster, overlap, shared in sorted(bucketEdges, key=lambda edge: (-edge[3], -edge[2], int(edge[0]), int(edge[1]))):
+            if cluster not in continued and nextCluster not in tracks[time]:
+                tracks[time][nextCluster] = previous[cluster]
+                continued.add(cluster)
+
+        for cluster in bucket[0]:
+            if cluster not in tracks[time]:
+                tracks[time][cluster] = trackCount
+                trackCount += 1
+        tracks[time] = {cluster: tracks[time][cluster] for cluster in bucket[0]}
+
+        edges += [[time - step, cluster, time, nextCluster, round(overlap, 4), shared] for cluster, nextCluster, overlap, shared in bucketEdges]
+
+    return {'tracks': tracks, 'edges': edges}
+
+
+def trackClusters(buckets, partitions, period, searchDistance=0):
+    #tracks of every partition, nested by partition key, from (partition, time, shapes, members) buckets of one time period
+    #members are clusterMembers of the bucket's records, so buckets can be collected without keeping their records
+    byPartition = {partition: {} for partition in partitions}
+    for partition, time, shapes, members in buckets:
+        byPartition[partition][time] = (shapes, members)
+
+    dictClusterTracks = {}
+    step = windowTime(1, period)
+    for partition, times in byPartition.items():
+        nestedDict(dictClusterTracks, partition).update(trackPartition(times, step, searchDistance))
+    return dictClusterTracks
@@ -105,6 +105,9 @@ function importDemoBuffer(client, buffer, session_id, callback) {
     tickInterval = demo.header.playbackTime / demo.header.playbackTicks;
     console.log('Tick interval:', tickInterval, ', Tick rate:', Math.round(1 / tickInterval));
 
+    // First row of the file, so the clustering script knows how long a tick is
+    writeRow(eventStream, [0, 'demo_header', {tickRate: Math.round(1 / tickInterval)}, null, null]);
+
     pace = require('pace')({total: demo.header.playbackTicks, maxBurden: 0.1});
   });
 
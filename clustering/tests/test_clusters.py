@@ -0,0 +1,57 @@
+## Graph DBSCAN backend against sklearn
+##
+## graphLabels has to give exactly the labels and core points sklearn's DBSCAN
+## gives, numbered the same way. Checked on seeded spawn-stacked buckets like
+## benchmarks/dbscan_backends.py makes, with chunkEntries small enough that the
+## neighbour queries run in many chunks, and on buckets with no core points.
+##
+## python -m unittest discover tests, from the clustering directory
+
+import os, sys, unittest
+import numpy as np
+
+from sklearn.cluster import DBSCAN
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csgo_clusters.clusters import graphLabels
+
+
+def spawnBucket(pointCount, seed):
+    #two spawn stacks plus players spread over the map, smaller than the benchmark's so the test stays quick
+    rng = np.random.default_rng(seed)
+    stacked = int(pointCount * 0.7)
+    spawns = np.array([[-500.0, -800.0], [300.0, 2200.0]])
+    points = spawns[rng.integers(0, 2, stacked)] + rng.normal(0, 150, (stacked, 2))
+    moving = rng.uniform([-2500, -1200], [2000, 3200], (pointCount - stacked, 2))
+    return np.concatenate([points, moving])
+
+
+class GraphLabelsTest(unittest.TestCase):
+
+    def assertSameAsSklearn(self, points, eps, minSamples, chunkEntries):
+        db = DBSCAN(eps=eps, min_samples=minSamples).fit(points)
+        labels, core = graphLabels(points, eps, minSamples, chunkEntries)
+        np.testing.assert_array_equal(labels, db.labels_)
+        np.testing.assert_array_equal(np.flatnonzero(core), db.core_sample_indices_)
+
+    def test_graphLabels_match_sklearn(self):
+        for seed in range(4):
+            points = spawnBucket(3000, seed)
+            for eps, minSamples in ((80, 30), (40, 10), (120, 50)):
+                with self.subTest(seed=seed, eps=eps, minSamples=minSamples):
+                    self.assertSameAsSklearn(points, eps, minSamples, chunkEntries=20000)
+
+    def test_one_chunk_per_point(self):
+        self.assertSameAsSklearn(spawnBucket(1000, 7), 80, 20, chunkEntries=1)
+
+    def test_no_core_points(self):
+        points = np.random.default_rng(0).uniform(0, 5000, (200, 2))
+        self.assertSameAsSklearn(points, 10, 5, chunkEntries=1000)
+
+        labels, core = graphLabels(np.zeros((0, 2)), 80, 30)
+        self.assertEqual((len(labels), len(core)), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+## Concave hulls against the original implementation
+##
+## referenceAlphaShape is alpha_shape as the script had it before hulls.py,
+## one triangle at a time with Heron's formula, and referenceConcaveHull its
+## retry loop, lowering alpha 5% and rebuilding until the shape is a Polygon.
+## Both are checked against hulls.py on fixed, seeded clusters of several
+## blobs each: the same geometry type and no area in their symmetric difference.
+##
+## python -m unittest discover tests, from the clustering directory
+
+import math, os, sys, unittest
+import numpy as np
+
+import shapely.geometry as geometry
+from shapely.ops import polygonize, unary_union
+from scipy.spatial import Delaunay
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csgo_clusters.hulls import circumradii, concaveHull, triangleUnion
+
+
+def referenceAlphaShape(points, alpha):
+    if len(points) < 4:
+        # If there is a triangle, no need to find an alpha shape.
+        return geometry.MultiPoint(list(points)).convex_hull, list(points)
+
+    def add_edge(edges, edge_points, coords, i, j):
+        if (i, j) in edges or (j, i) in edges:
+            # already added
+            return
+        edges.add((i, j))
+        edge_points.append(coords[[i, j]])
+
+    tri = Delaunay(points)
+    edges = set()
+    edge_points = []
+    for ia, ib, ic in tri.simplices:
+        pa = points[ia]
+        pb = points[ib]
+        pc = points[ic]
+
+        # Lengths of sides of triangle
+        a = math.sqrt((pa[0] - pb[0]) ** 2 + (pa[1] - pb[1]) ** 2)
+        b = math.sqrt((pb[0] - pc[0]) ** 2 + (pb[1] - pc[1]) ** 2)
+        c = math.sqrt((pc[0] - pa[0]) ** 2 + (pc[1] - pa[1]) ** 2)
+
+        # Area of triangle by Heron's formula
+        s = (a + b + c) / 2.0
+        area = math.sqrt(s * (s - a) * (s - b) * (s - c))
+
+        circum_r = a * b * c / (4.0 * area)
+        if circum_r < 1.0 / alpha:
+            add_edge(edges, edge_points, points, ia, ib)
+            add_edge(edges, edge_points, points, ib, ic)
+            add_edge(edges, edge_points, points, ic, ia)
+    m = geometry.MultiLineString(edge_points)
+    return unary_union(list(polygonize(m))), edge_points
+
+
+def referenceConcaveHull(points, alpha=0.01, alphaDecay=0.05):
+    alphaVal = alpha
+    concave_hull, edge_points = referenceAlphaShape(points, alphaVal)
+    while type(concave_hull) is not geometry.polygon.Polygon:
+        alphaVal -= alphaVal * alphaDecay
+        concave_hull, edge_points = referenceAlphaShape(points, alphaVal)
+    return concave_hull, alphaVal
+
+
+def fixedClusters():
+    #clusters of one to four gaussian blobs, some far enough apart that the first alpha splits them
+    clusters = []
+    for seed in range(16):
+        random = np.random.RandomState(seed)
+        blobs = random.randint(1, 5)
+        centres = random.uniform(-600, 600, size=(blobs, 2))
+        sizes = random.randint(20, 150, size=blobs)
+        spreads = random.uniform(20, 120, size=blobs)
+        clusters.append(np.concatenate([random.normal(centre, spread, size=(size, 2)) for centre, size, spread in zip(centres, sizes, spreads)]))
+    return clusters
+
+
+class AlphaShapeTest(unittest.TestCase):
+
+    def assertSameShape(self, shape, reference):
+        self.assertIs(type(shape), type(reference))
+        self.assertAlmostEqual(shape.symmetric_difference(reference).area, 0.0, places=6)
+
+    def test_triangleUnion_matches_alpha_shape(self):
+        for points in fixedClusters():
+            tri = Delaunay(points)
+            radii = circumradii(points, tri.simplices)
+            for alpha in (0.02, 0.01, 0.005, 0.002):
+                shape, edge_points = triangleUnion(points, tri.simplices[radii < 1.0 / alpha])
+                self.assertSameShape(shape, referenceAlphaShape(points, alpha)[0])
+
+    def test_concaveHull_matches_retry_loop(self):
+        retried = 0
+        for points in fixedClusters():
+            hull, alpha, steps = concaveHull(points, alpha=0.01, alphaDecay=0.05)
+            reference, referenceAlpha = referenceConcaveHull(points, alpha=0.01, alphaDecay=0.05)
+            self.assertAlmostEqual(alpha, referenceAlpha)
+            self.assertSameShape(hull, reference)
+            retried += steps > 0
+        #the clusters have to exercise the retries as well as the first alpha
+        self.assertGreater(retried, 0)
+
+    def test_small_and_collinear_clusters(self):
+        triangle = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+        self.assertSameShape(concaveHull(triangle)[0], referenceAlphaShape(triangle, 0.01)[0])
+
+        line = np.array([[float(i), 2.0 * i] for i in range(10)])
+        hull, alpha, steps = concaveHull(line)
+        self.assertIsNone(alpha)
+        self.assertIs(type(hull), geometry.LineString)
+
+
+if __name__ == '__main__':
+    unittest.main()
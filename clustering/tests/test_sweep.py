@@ -0,0 +1,51 @@
+## Parameter sweep against sklearn
+##
+## sweepLabels has to give every (eps, minSamples) of a grid exactly the labels
+## sklearn's DBSCAN gives at that setting. Checked on seeded spawn-stacked
+## buckets, with chunkEntries small enough that the neighbour queries run in
+## many chunks, and on an integer lattice where many distances equal an eps.
+##
+## python -m unittest discover tests, from the clustering directory
+
+import os, sys, unittest
+import numpy as np
+
+from sklearn.cluster import DBSCAN
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csgo_clusters.sweep import sweepBucket, sweepGraph, sweepLabels
+from test_clusters import spawnBucket
+
+
+class SweepLabelsTest(unittest.TestCase):
+
+    def assertSameAsSklearn(self, points, epsValues, minSamplesValues, chunkEntries=250000):
+        settings = []
+        for eps, minSamples, labels in sweepLabels(sweepGraph(points, epsValues, minSamplesValues, chunkEntries)):
+            settings.append((eps, minSamples))
+            with self.subTest(eps=eps, minSamples=minSamples):
+                np.testing.assert_array_equal(labels, DBSCAN(eps=eps, min_samples=minSamples).fit_predict(points))
+        self.assertEqual(settings, [(eps, minSamples) for minSamples in minSamplesValues for eps in epsValues])
+
+    def test_sweepLabels_match_sklearn(self):
+        for seed, chunkEntries in ((0, 250000), (1, 5000), (2, 1)):
+            with self.subTest(seed=seed, chunkEntries=chunkEntries):
+                self.assertSameAsSklearn(spawnBucket(2000, seed), [30, 60, 80, 120], [5, 10, 30, 50], chunkEntries)
+
+    def test_distances_equal_to_eps(self):
+        points = np.random.default_rng(1).integers(0, 60, (1500, 2)).astype(float)
+        self.assertSameAsSklearn(points, [1, np.sqrt(2), 2, 5], [3, 5, 9])
+
+    def test_empty_bucket(self):
+        labels = list(sweepLabels(sweepGraph(np.zeros((0, 2)), [40, 80], [10, 30])))
+        self.assertEqual([(eps, minSamples, len(l)) for eps, minSamples, l in labels],
+                         [(40, 10, 0), (80, 10, 0), (40, 30, 0), (80, 30, 0)])
+
+    def test_sweepBucket_scores_every_setting(self):
+        scores = sweepBucket(spawnBucket(1000, 3), [80, 40], [30, 10])[0]
+        self.assertEqual(len(scores), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()